@@ -1,9 +1,10 @@
-from flask import Flask, render_template
+from flask import Flask, render_template, request, session, g
+import time
 
 app = Flask(__name__)
 app.config.from_object('config')
 
-from app import views
+from app import views, profiler, recorder
 
 
 # ERROR PAGES
@@ -15,3 +16,42 @@ def page_not_found(e):
 @app.route('/failed_query', methods=['GET'])
 def failed_query(query):
     return render_template('failed_query.html', query=query)
+
+
+# REQUEST PROFILER
+@app.before_request
+def start_profile():
+    if profiler.wanted(request.headers):
+        g.profile = profiler.ProfiledCall(profiler.settings()['mode'])
+
+
+@app.after_request
+def finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        response.headers['X-Profile'] = profile.finish(request.endpoint or 'unmatched')
+    return response
+
+
+@app.teardown_request
+def finish_failed_profile(error):
+    # after_request is skipped when a view raises
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.finish(request.endpoint or 'unmatched')
+
+
+# TRAFFIC RECORDER
+if app.config['RECORD_TRAFFIC']:
+    @app.before_request
+    def start_recording():
+        g.recording_started = time.perf_counter()
+        g.recording_role = session.get('perms')  # Before a login can change it
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('recording_started')
+        if started is not None and request.endpoint != 'static':
+            recorder.record(request, g.get('recording_role'), response.status_code,
+                            time.perf_counter() - started)
+        return response
@@ -1,61 +1,460 @@
-from flask import redirect, url_for
+from flask import redirect, url_for, request, has_request_context
+import base64
+import binascii
+import collections
+import concurrent.futures
+import contextlib
+import csv
 import datetime
+import io
+import json
+import logging
+import logging.handlers
+import os
+import random
+import re
+import threading
+import time
 import psycopg2
+import psycopg2.extensions
 import bcrypt
 
-from config import SQLALCHEMY_DATABASE_URI
+from app import metrics
+
+from config import (
+    SQLALCHEMY_DATABASE_URI, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT,
+    DB_POOL_MAX_USES, DB_POOL_MAX_AGE, DB_POOL_PING_AFTER, PAGE_SIZE,
+    AUTH_WORKERS, AUTH_QUEUE_DEPTH, AUTH_TIMEOUT, BCRYPT_ROUNDS, STREAM_ITERSIZE,
+    SLOW_QUERY_SECONDS, SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_LOG, SLOW_QUERY_LOG_BYTES,
+    SLOW_QUERY_LOG_BACKUPS
+)
+
+
+# CONNECTION POOL
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the pool timeout."""
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that records execute and fetch times, row counts and errors per query shape."""
+
+    _fingerprint = None
+
+    def execute(self, sql, args=None):
+        self._fingerprint = metrics.fingerprint(sql)
+        started = time.perf_counter()
+        try:
+            result = super(TimedCursor, self).execute(sql, args)
+        except psycopg2.Error:
+            metrics.DB_ERRORS.labels(self._fingerprint).inc()
+            metrics.DB_QUERY_SECONDS.labels(self._fingerprint, 'execute').observe(
+                time.perf_counter() - started
+            )
+            raise
+        elapsed = time.perf_counter() - started
+        metrics.DB_QUERY_SECONDS.labels(self._fingerprint, 'execute').observe(elapsed)
+        if elapsed >= SLOW_QUERY_SECONDS:
+            log_slow_query(self, sql, args, elapsed)
+        return result
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        rows = fetch(*args)
+        fingerprint = self._fingerprint or 'unknown'
+        metrics.DB_QUERY_SECONDS.labels(fingerprint, 'fetch').observe(
+            time.perf_counter() - started
+        )
+        metrics.DB_ROWS.labels(fingerprint).inc(
+            len(rows) if isinstance(rows, list) else int(rows is not None)
+        )
+        return rows
+
+    def fetchone(self):
+        return self._timed_fetch(super(TimedCursor, self).fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._timed_fetch(super(TimedCursor, self).fetchmany)
+        return self._timed_fetch(super(TimedCursor, self).fetchmany, size)
+
+    def fetchall(self):
+        return self._timed_fetch(super(TimedCursor, self).fetchall)
+
+    def __iter__(self):
+        # Named cursors are read by iterating; record the whole read once it stops
+        rows = 0
+        next_row = super(TimedCursor, self).__next__  # The base cursor is its own iterator
+        started = time.perf_counter()
+        try:
+            while True:
+                try:
+                    row = next_row()
+                except StopIteration:
+                    break
+                rows += 1
+                yield row
+        finally:
+            fingerprint = self._fingerprint or 'unknown'
+            metrics.DB_QUERY_SECONDS.labels(fingerprint, 'fetch').observe(
+                time.perf_counter() - started
+            )
+            metrics.DB_ROWS.labels(fingerprint).inc(rows)
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of psycopg2 connections owned by a single process.
+
+    Idle connections are pinged on checkout once they have sat unused for
+    ping_after seconds, and are recycled after max_uses checkouts or once
+    they are max_age seconds old.
+    """
+
+    def __init__(self, dsn, min_size, max_size, timeout, max_uses, max_age, ping_after):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.ping_after = ping_after
+        self.stats = collections.Counter()
+
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, idle_since) pairs, most recently returned last
+        self._meta = {}  # conn -> [created_at, uses]
+        self._size = 0
+
+        for _ in range(min(min_size, max_size)):
+            self._idle.append((self._connect(), time.time()))
+            self._size += 1
+
+    def _connect(self):
+        started = time.perf_counter()
+        conn = psycopg2.connect(self.dsn, cursor_factory=TimedCursor)
+        metrics.DB_CONNECT_SECONDS.observe(time.perf_counter() - started)
+        self._meta[conn] = [time.time(), 0]
+        self.stats['connects'] += 1
+        return conn
+
+    def _close(self, conn):
+        self._meta.pop(conn, None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_expired(self, conn):
+        created_at, uses = self._meta[conn]
+        return uses >= self.max_uses or time.time() - created_at >= self.max_age
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.time() - idle_since < self.ping_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            self.stats['failed_health_checks'] += 1
+            return False
+
+    def getconn(self):
+        """Checks out a healthy connection, waiting up to timeout seconds for one."""
+        conn = None
+        wait_started = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve a slot; the connection is opened outside the lock
+                    self._size += 1
+                    break
+                if wait_started is None:
+                    wait_started = time.time()
+                    self.stats['waits'] += 1
+                remaining = self.timeout - (time.time() - wait_started)
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeout(
+                        'No database connection became free within %s seconds' % self.timeout
+                    )
+                self._cond.wait(remaining)
+
+            self.stats['checkouts'] += 1
+            if wait_started is not None:
+                self.stats['wait_seconds'] += time.time() - wait_started
+
+        if conn is not None and not self._is_healthy(conn, idle_since):
+            self._close(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except psycopg2.Error:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        self._meta[conn][1] += 1
+        return conn
+
+    def putconn(self, conn):
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        if not conn.closed:
+            status = conn.get_transaction_status()
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    self._close(conn)
+
+        if conn.closed or self._is_expired(conn):
+            if not conn.closed:
+                self.stats['recycled'] += 1
+            self._close(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+        else:
+            with self._cond:
+                self._idle.append((conn, time.time()))
+                self._cond.notify()
+
+
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+_INHERITED_POOLS = []  # Kept referenced so forked children never close the parent's sockets
+
+
+def get_pool():
+    """Returns this process's connection pool, creating a fresh one after a fork."""
+    global _POOL, _POOL_PID
+    pid = os.getpid()
+    if _POOL_PID != pid:
+        with _POOL_LOCK:
+            if _POOL_PID != pid:
+                if _POOL is not None:
+                    _INHERITED_POOLS.append(_POOL)
+                _POOL = ConnectionPool(
+                    SQLALCHEMY_DATABASE_URI, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+                    DB_POOL_TIMEOUT, DB_POOL_MAX_USES, DB_POOL_MAX_AGE, DB_POOL_PING_AFTER
+                )
+                _POOL_PID = pid
+    return _POOL
+
+
+def pool_stats():
+    """Returns the checkout/wait counters and current size of this process's pool."""
+    pool = get_pool()
+    stats = dict(pool.stats)
+    stats['size'] = pool._size
+    stats['idle'] = len(pool._idle)
+    return stats
+
+
+@contextlib.contextmanager
+def pooled_connection():
+    """Checks a connection out of the pool for the duration of a with block."""
+    pool = get_pool()
+    started = time.perf_counter()
+    conn = pool.getconn()
+    metrics.DB_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+# SLOW QUERY LOG
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'VALUES')
+_WRITES = re.compile(r'\b(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+_SLOW_QUERY_LOGGER = None
+_SLOW_QUERY_LOCK = threading.Lock()
+
+
+def _slow_query_logger():
+    """Returns the logger that appends one JSON object per line to SLOW_QUERY_LOG."""
+    global _SLOW_QUERY_LOGGER
+    if _SLOW_QUERY_LOGGER is None:
+        with _SLOW_QUERY_LOCK:
+            if _SLOW_QUERY_LOGGER is None:
+                # Workers share the file; each record is one short append, but a rotation
+                # racing another worker's write can lose that line
+                handler = logging.handlers.RotatingFileHandler(
+                    SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_BYTES,
+                    backupCount=SLOW_QUERY_LOG_BACKUPS
+                )
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger = logging.getLogger('lost.slow_queries')
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                logger.addHandler(handler)
+                _SLOW_QUERY_LOGGER = logger
+    return _SLOW_QUERY_LOGGER
+
+
+def _redact_params(args):
+    """Returns the type names of a statement's parameters, never their values."""
+    if args is None:
+        return None
+    if isinstance(args, dict):
+        return {name: type(value).__name__ for name, value in args.items()}
+    return [type(value).__name__ for value in args]
+
+
+def _redact_plan(node):
+    """Replaces the literals in a JSON plan's conditions and filters with ?."""
+    if isinstance(node, list):
+        return [_redact_plan(child) for child in node]
+    if isinstance(node, dict):
+        redacted = {}
+        for key, value in node.items():
+            if isinstance(value, str) and ('Cond' in key or 'Filter' in key):
+                redacted[key] = metrics.fingerprint(value)
+            else:
+                redacted[key] = _redact_plan(value)
+        return redacted
+    return node
+
+
+def _explain_analyze(cur, sql, args):
+    """Returns the EXPLAIN (ANALYZE, BUFFERS) plan of a statement just run on cur, or none.
+
+    Reads run a second time inside a savepoint that is rolled back. Writes only get a
+    plain EXPLAIN: running them again would collide with the rows they just wrote.
+    """
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8')
+    if cur.name is not None or not isinstance(sql, str) or \
+            not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    conn = cur.connection
+    if conn.autocommit or conn.get_transaction_status() != \
+            psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+        return None
+
+    plan_cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)  # Untimed
+    try:
+        plan_cur.execute("SAVEPOINT slow_query_explain;")
+        try:
+            if _WRITES.search(sql):
+                plan_cur.execute("EXPLAIN (FORMAT JSON) " + sql, args)
+            else:
+                plan_cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, args)
+            plan = plan_cur.fetchone()[0]
+        finally:
+            plan_cur.execute("ROLLBACK TO SAVEPOINT slow_query_explain;")
+            plan_cur.execute("RELEASE SAVEPOINT slow_query_explain;")
+    except psycopg2.Error as e:
+        # Error messages can quote parameter values, so only the class and code are kept
+        return {'error': type(e).__name__, 'pgcode': e.pgcode}
+    finally:
+        plan_cur.close()
+    return _redact_plan(plan)
+
+
+def log_slow_query(cur, sql, args, elapsed):
+    """Appends a statement that took over SLOW_QUERY_SECONDS to the slow-query log."""
+    record = {
+        'at': datetime.datetime.utcnow().isoformat() + 'Z',
+        'seconds': round(elapsed, 6),
+        'query': metrics.fingerprint(sql),
+        'params': _redact_params(args),
+        'view': request.endpoint if has_request_context() else None,
+        'pid': os.getpid(),
+    }
+    if random.random() < SLOW_QUERY_EXPLAIN_RATE:
+        record['plan'] = _explain_analyze(cur, sql, args)
+    _slow_query_logger().info(json.dumps(record, default=str))
 
 
 # DATABASE FUNCTIONS
+class TransactionFailed(Exception):
+    """Raised when a transaction() block is rolled back because a statement failed."""
+
+
+@contextlib.contextmanager
+def transaction():
+    """Yields one cursor whose statements are committed together or not at all."""
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            print("QUERY FAILED")
+            print(e)
+            raise TransactionFailed(str(e))
+        finally:
+            cur.close()
+
+
 def db_query(sql, data_list):
     """Returns none or a list of tuples from a SQL query and passed values."""
-    conn = psycopg2.connect(SQLALCHEMY_DATABASE_URI)
-    cur = conn.cursor()
-    cur.execute(sql, data_list)
-
-    # Return data as an array of dictionaries
-    result = cur.fetchall()
-    records = []
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, data_list)
+        result = cur.fetchall()
+        conn.commit()
+        cur.close()
 
     # If the query returns something...
     if len(result) != 0:
-        for row in result:
-            records.append(row)
-        conn.commit()
-        cur.close()
-        conn.close()
-        return records
+        return list(result)
     else:
-        conn.commit()
-        cur.close()
-        conn.close()
         return None
 
 
+def stream_query(sql, data_list, itersize=None):
+    """Yields the rows of a SQL query one at a time from a server-side cursor.
+
+    Only itersize rows are held in memory at once. The pooled connection stays checked
+    out until the generator is exhausted or closed.
+    """
+    with pooled_connection() as conn:
+        cur = conn.cursor(name='stream_cursor')
+        cur.itersize = itersize or STREAM_ITERSIZE
+        try:
+            cur.execute(sql, data_list)
+            for row in cur:
+                yield row
+        finally:
+            cur.close()
+            conn.rollback()  # Read-only; just ends the transaction holding the cursor
+
+
 def db_change(sql, data_list):
     """Updates database using passed INSERT or UPDATE SQL command and vars."""
-    conn = psycopg2.connect(SQLALCHEMY_DATABASE_URI)
-    cur = conn.cursor()
-    try:
-        cur.execute(sql, data_list)
-    except Exception as e:
-        print("QUERY FAILED")
-        print(e)
-        redirect(url_for('failed_query'))
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, data_list)
+        except Exception as e:
+            print("QUERY FAILED")
+            print(e)
+            conn.rollback()
+            redirect(url_for('failed_query'))
+        else:
+            conn.commit()
+        cur.close()
 
 
 def duplicate_check(sql, data_list):
     """Returns True if a query yields a result and False if not."""
-    conn = psycopg2.connect(SQLALCHEMY_DATABASE_URI)
-    cur = conn.cursor()
-    cur.execute(sql, data_list)
-    result = cur.fetchall()
-    cur.close()
-    conn.close()
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, data_list)
+        result = cur.fetchall()
+        cur.close()
     if result:
         return True
     else:
@@ -71,33 +470,351 @@ def validate_date(submitted_date):
         raise ValueError('Incorrect data format, should be MM/DD/YYYY')
 
 
+# PAGINATION FUNCTIONS
+def encode_cursor(key_values):
+    """Packs the seek-key values of a row into an opaque URL-safe page cursor."""
+    packed = json.dumps(list(key_values), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(packed).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Unpacks a page cursor made by encode_cursor; raises ValueError if it is malformed."""
+    try:
+        key_values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, UnicodeError, binascii.Error) as e:
+        raise ValueError('Malformed page cursor: %s' % e)
+    if not isinstance(key_values, list):
+        raise ValueError('Malformed page cursor')
+    return key_values
+
+
+def estimate_count(sql, data_list):
+    """Returns the planner's row estimate for a query without running it."""
+    with pooled_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql, data_list)
+        plan = cur.fetchone()[0]
+        cur.close()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def keyset_page(sql, data_list, keys, after=None, before=None, page_size=None):
+    """Returns one page of a query using keyset (seek) pagination.
+
+    sql must contain a {keyset} placeholder in its WHERE clause, after every other %s,
+    and end with an {order} placeholder. keys are the column expressions to seek on, in
+    sort order, and must also be the last columns the query selects. after/before are
+    cursors from a previous page. The result is a dict with the page's rows, cursors for
+    the following and preceding pages (None at either end) and a planner row estimate.
+    """
+    page_size = page_size or PAGE_SIZE
+    key_list = ', '.join(keys)
+    estimate = estimate_count(sql.format(keyset='TRUE', order=''), data_list)
+
+    if before:
+        values = decode_cursor(before)
+        comparison, direction = '<', 'DESC'
+    elif after:
+        values = decode_cursor(after)
+        comparison, direction = '>', 'ASC'
+    else:
+        values, comparison, direction = None, None, 'ASC'
+
+    if values is None:
+        keyset, seek_values = 'TRUE', []
+    else:
+        if len(values) != len(keys):
+            raise ValueError('Page cursor does not match this listing')
+        # The bound on the leading key alone lets its index skip straight to the page
+        keyset = '{first} {op}= %s AND ({keys}) {op} ({params})'.format(
+            first=keys[0], op=comparison, keys=key_list,
+            params=', '.join(['%s'] * len(keys))
+        )
+        seek_values = [values[0]] + list(values)
+
+    order = 'ORDER BY {} LIMIT {:d}'.format(
+        ', '.join('{} {}'.format(key, direction) for key in keys), page_size + 1
+    )
+    rows = db_query(sql.format(keyset=keyset, order=order), list(data_list) + seek_values) or []
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before:
+        rows.reverse()
+
+    def cursor_for(row):
+        return encode_cursor(row[-len(keys):])
+
+    if before:
+        prev_cursor = cursor_for(rows[0]) if has_more and rows else None
+        next_cursor = cursor_for(rows[-1]) if rows else None
+    else:
+        prev_cursor = cursor_for(rows[0]) if after and rows else None
+        next_cursor = cursor_for(rows[-1]) if has_more else None
+
+    return {'rows': rows, 'before': prev_cursor, 'after': next_cursor, 'estimate': estimate}
+
+
+# UPLOAD FUNCTIONS
+TIMESTAMP_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y')
+TAG_SEPARATORS = re.compile(r'[\s,;]+')
+
+
+def iter_csv_upload(upload, columns):
+    """Yields the rows of an uploaded CSV file as dicts of stripped strings, one at a time.
+
+    Raises ValueError if the file is not UTF-8 CSV or its header lacks any of columns.
+    """
+    try:
+        reader = csv.DictReader(io.TextIOWrapper(upload.stream, encoding='utf-8-sig',
+                                                 newline=''))
+        header = [name.strip() for name in reader.fieldnames or []]
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise ValueError('The file needs a header row with the column(s): '
+                             + ', '.join(missing))
+        reader.fieldnames = header
+        for row in reader:
+            yield dict((name, (value or '').strip()) for name, value in row.items() if name)
+    except (csv.Error, UnicodeDecodeError):
+        raise ValueError('The file could not be read as CSV.')
+
+
+def read_csv_upload(upload, columns):
+    """Returns every row of an uploaded CSV file; see iter_csv_upload."""
+    return list(iter_csv_upload(upload, columns))
+
+
+def read_tag_list():
+    """Returns the tags pasted into a bulk form or uploaded with it, in order, once each.
+
+    Tags may be separated by newlines, spaces, commas or semicolons; a leading asset_tag
+    header, as in a CSV export, is ignored. Raises ValueError if the upload is not UTF-8.
+    """
+    texts = [request.form.get('tag_list', '')]
+    upload = request.files.get('tags_file')
+    if upload:
+        try:
+            texts.append(upload.stream.read().decode('utf-8-sig'))
+        except UnicodeDecodeError:
+            raise ValueError('The tag file could not be read as text.')
+
+    tags = []
+    for text in texts:
+        text_tags = [tag for tag in TAG_SEPARATORS.split(text) if tag]
+        tags += text_tags[1:] if text_tags[:1] == ['asset_tag'] else text_tags
+    return list(collections.OrderedDict.fromkeys(tags))
+
+
+def validate_timestamp(submitted):
+    """Returns a datetime for YYYY-MM-DD [HH:MM[:SS]] or MM/DD/YYYY, or raises ValueError."""
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(submitted, timestamp_format)
+        except ValueError:
+            pass
+    raise ValueError('Incorrect date format, should be YYYY-MM-DD or MM/DD/YYYY')
+
+
+# FACILITY CACHE
+FACILITIES_CHANNEL = 'facilities_changed'
+_FACILITIES = None
+_FACILITIES_PID = None
+_FACILITIES_LISTENER = None
+_FACILITIES_LOCK = threading.Lock()
+_INHERITED_LISTENERS = []  # Same as _INHERITED_POOLS: never close a parent's socket
+
+
+def _facilities_listener():
+    """Returns this process's LISTEN connection, or None if the cache must be refilled.
+
+    Called with _FACILITIES_LOCK held. A new or reconnected listener may have missed
+    notifications, so the cached list is dropped whenever one is opened.
+    """
+    global _FACILITIES, _FACILITIES_PID, _FACILITIES_LISTENER
+    pid = os.getpid()
+    if _FACILITIES_PID != pid:
+        if _FACILITIES_LISTENER is not None:
+            _INHERITED_LISTENERS.append(_FACILITIES_LISTENER)
+        _FACILITIES, _FACILITIES_PID, _FACILITIES_LISTENER = None, pid, None
+
+    listener = _FACILITIES_LISTENER
+    if listener is not None:
+        try:
+            listener.poll()
+            if listener.notifies:
+                del listener.notifies[:]
+                _FACILITIES = None
+            return listener
+        except psycopg2.Error:
+            listener.close()
+            _FACILITIES_LISTENER = None
+
+    # LISTEN before the facilities are read, so no committed change can slip between
+    _FACILITIES = None
+    listener = psycopg2.connect(SQLALCHEMY_DATABASE_URI)
+    listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = listener.cursor()
+    cur.execute("LISTEN " + FACILITIES_CHANNEL + ";")
+    cur.close()
+    _FACILITIES_LISTENER = listener
+    return listener
+
+
+def get_facilities():
+    """Returns none or a list of every facility row, cached until a facility is added."""
+    global _FACILITIES
+    with _FACILITIES_LOCK:
+        _facilities_listener()
+        if _FACILITIES is None:
+            _FACILITIES = db_query("SELECT * FROM facilities;", []) or []
+        return _FACILITIES or None
+
+
+def invalidate_facilities(cur):
+    """Drops cached facility lists in every worker once cur's transaction commits."""
+    global _FACILITIES
+    cur.execute("NOTIFY " + FACILITIES_CHANNEL + ";")
+    with _FACILITIES_LOCK:
+        _FACILITIES = None
+
+
 # AUTHORIZATION FUNCTIONS
-def _get_hash_for_user(username):
-    password = bytes(db_query("SELECT password FROM users WHERE username=%s;", [username])[0][0])
-    return password
+class AuthServiceBusy(Exception):
+    """Raised when AUTH_QUEUE_DEPTH password checks are already running or waiting."""
+
+
+_AUTH_EXECUTOR = None
+_AUTH_SLOTS = None
+_AUTH_PID = None
+_AUTH_LOCK = threading.Lock()
+
+
+def _auth_executor():
+    """Returns this process's password-check thread pool and its queue-depth semaphore."""
+    global _AUTH_EXECUTOR, _AUTH_SLOTS, _AUTH_PID
+    pid = os.getpid()
+    if _AUTH_PID != pid:
+        with _AUTH_LOCK:
+            if _AUTH_PID != pid:
+                # Threads do not survive a fork, so a child always starts its own pool
+                _AUTH_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=AUTH_WORKERS)
+                _AUTH_SLOTS = threading.BoundedSemaphore(AUTH_QUEUE_DEPTH)
+                _AUTH_PID = pid
+    return _AUTH_EXECUTOR, _AUTH_SLOTS
+
+
+def _checkpw(password, stored_hash):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), stored_hash)
+    except ValueError:
+        # Not a bcrypt hash, so no password can match it
+        return False
 
 
-def _get_salt_for_user(username):
-    salt = bytes(db_query("SELECT salt FROM users WHERE username=%s;", [username])[0][0])
-    return salt
+def hash_password(password, rounds=None):
+    """Returns a (hash, salt) pair for a new password at BCRYPT_ROUNDS unless told otherwise."""
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt), salt
 
 
-def _create_password_hash(password):
-    salt = bcrypt.gensalt(16)
-    hashed_pass = bcrypt.hashpw(password, salt)
-    return hashed_pass, salt
+def hash_passwords(passwords):
+    """Returns (hash, salt) pairs for a batch of new passwords, AUTH_WORKERS at a time."""
+    # A pool of its own, so a bulk load never queues ahead of logins on the auth pool
+    with concurrent.futures.ThreadPoolExecutor(max_workers=AUTH_WORKERS) as executor:
+        return list(executor.map(hash_password, passwords))
 
 
-def _check_hash_for_user(username, password):
-    stored_hash = _get_hash_for_user(username)
-    generated_hash = _recreate_hash(password, _get_salt_for_user(username))
-    return stored_hash == generated_hash
+_BACKGROUND_EXECUTOR = None
+_BACKGROUND_PID = None
 
 
-def _recreate_hash(password, salt):
-    hash_pass = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hash_pass
+def run_later(function, *args):
+    """Returns the future of function(*args), run on this process's one background thread.
+
+    For work too slow to hold a request thread, such as hashing a large batch of new
+    passwords. Jobs run one at a time and are lost if the process exits first.
+    """
+    global _BACKGROUND_EXECUTOR, _BACKGROUND_PID
+    pid = os.getpid()
+    if _BACKGROUND_PID != pid:
+        with _AUTH_LOCK:
+            if _BACKGROUND_PID != pid:
+                _BACKGROUND_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                _BACKGROUND_PID = pid
+    return _BACKGROUND_EXECUTOR.submit(function, *args)
+
+
+def hash_cost(stored_hash):
+    """Returns the work factor recorded in a bcrypt hash ($2b$<cost>$...), or none."""
+    parts = bytes(stored_hash).split(b'$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def needs_rehash(stored_hash):
+    """Returns whether a stored hash was made with fewer rounds than BCRYPT_ROUNDS."""
+    cost = hash_cost(stored_hash)
+    return cost is not None and cost < BCRYPT_ROUNDS
+
+
+def _rehash(user_pk, password, stored_hash):
+    new_hash, salt = hash_password(password)
+    # Only replace the hash that was verified, in case the password changed meanwhile
+    with transaction() as cur:
+        cur.execute("UPDATE users SET password = %s, salt = %s "
+                    "WHERE user_pk = %s AND password = %s;",
+                    [new_hash, salt, user_pk, stored_hash])
+
+
+def rehash_later(user_pk, password, stored_hash):
+    """Upgrades a just-verified hash to BCRYPT_ROUNDS on the auth pool, if it has room."""
+    executor, slots = _auth_executor()
+    if not slots.acquire(blocking=False):
+        return False  # Busy: the next successful login will try again
+    try:
+        future = executor.submit(_rehash, user_pk, password, stored_hash)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda done: slots.release())
+    return True
+
+
+def fetch_user(username):
+    """Returns none or the (user_pk, role_fk, active, password) row for a username."""
+    result = db_query("SELECT user_pk, role_fk, active, password FROM users WHERE username = %s;",
+                      [username])
+    if result is None:
+        return None
+    user_pk, role_fk, active, password = result[0]
+    return user_pk, role_fk, active, bytes(password)
+
+
+def check_password(password, stored_hash):
+    """Returns whether password matches a stored bcrypt hash, checked on the auth pool.
+
+    Raises AuthServiceBusy instead of queueing when the pool is already full.
+    """
+    executor, slots = _auth_executor()
+    if not slots.acquire(blocking=False):
+        raise AuthServiceBusy()
+    try:
+        future = executor.submit(_checkpw, password, stored_hash)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda done: slots.release())
+    try:
+        return future.result(timeout=AUTH_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        raise AuthServiceBusy()
 
 
 def authorize(username, password):
-    return _check_hash_for_user(username, password)
+    """Returns the user row for a username if password matches it, otherwise none."""
+    user = fetch_user(username)
+    if user is not None and check_password(password, user[3]):
+        return user
+    return None
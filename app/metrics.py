@@ -0,0 +1,73 @@
+import os
+import re
+
+from config import METRICS_DIR
+
+# Every gunicorn worker writes its samples under METRICS_DIR so /metrics can add them
+# up; this has to be set before prometheus_client is first imported.
+os.environ.setdefault('prometheus_multiproc_dir', METRICS_DIR)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.environ['prometheus_multiproc_dir'])
+if not os.path.isdir(os.environ['prometheus_multiproc_dir']):
+    os.makedirs(os.environ['prometheus_multiproc_dir'])
+
+from prometheus_client import (  # noqa: E402
+    CollectorRegistry, Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST, multiprocess
+)
+
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+DB_CONNECT_SECONDS = Histogram(
+    'lost_db_connect_seconds', 'Time to open a new database connection',
+    buckets=LATENCY_BUCKETS
+)
+DB_CHECKOUT_SECONDS = Histogram(
+    'lost_db_checkout_seconds', 'Time to check a connection out of the pool, waits included',
+    buckets=LATENCY_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram(
+    'lost_db_query_seconds', 'Time spent in each phase of a query, by query fingerprint',
+    ['fingerprint', 'phase'], buckets=LATENCY_BUCKETS
+)
+DB_ROWS = Counter(
+    'lost_db_rows_total', 'Rows fetched, by query fingerprint', ['fingerprint']
+)
+DB_ERRORS = Counter(
+    'lost_db_errors_total', 'Statements that raised a database error, by query fingerprint',
+    ['fingerprint']
+)
+REQUEST_SECONDS = Histogram(
+    'lost_http_request_seconds', 'Time to answer a request, by route',
+    ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS
+)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s")
+_VALUE_LISTS = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Returns sql with its literals and placeholders replaced by ?, for use as a label.
+
+    Queries that differ only in their values, or in how many rows a VALUES list carries,
+    share one fingerprint, so the number of label values stays bounded.
+    """
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)  # psycopg2.sql.Composed
+    sql = _LITERALS.sub('?', _SPACES.sub(' ', sql).strip())
+    sql = _VALUE_LISTS.sub('(...)', sql)
+    return re.sub(r'(\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+)', '(...)', sql)
+
+
+def latest():
+    """Returns the (body, content type) of every worker's metrics, summed."""
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid):
+    """Drops a finished worker's live gauges; its counters and histograms are kept."""
+    multiprocess.mark_process_dead(pid)
@@ -0,0 +1,142 @@
+import collections
+import cProfile
+import datetime
+import hmac
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from config import (
+    PROFILE_RATE, PROFILE_MODE, PROFILE_INTERVAL, PROFILE_TOKEN, PROFILE_DIR, PROFILE_CONTROL
+)
+
+
+MODES = ('sample', 'cprofile')
+CONTROL_CHECK_SECONDS = 1.0
+
+_settings = {'rate': PROFILE_RATE, 'mode': PROFILE_MODE}
+_control = {'checked_at': 0.0, 'mtime': None}
+_control_lock = threading.Lock()
+_file_numbers = itertools.count()
+
+
+def settings():
+    """Returns the current {'rate', 'mode'}, re-reading PROFILE_CONTROL if it has changed.
+
+    The control file is looked at no more than once a second per worker, so switching the
+    profiler on or off takes effect within a second without a restart.
+    """
+    now = time.time()
+    if now - _control['checked_at'] < CONTROL_CHECK_SECONDS:
+        return _settings
+    with _control_lock:
+        if now - _control['checked_at'] < CONTROL_CHECK_SECONDS:
+            return _settings
+        _control['checked_at'] = now
+        try:
+            mtime = os.path.getmtime(PROFILE_CONTROL)
+        except OSError:
+            mtime = None
+        if mtime == _control['mtime']:
+            return _settings
+        _control['mtime'] = mtime
+
+        rate, mode = PROFILE_RATE, PROFILE_MODE
+        if mtime is not None:
+            try:
+                with open(PROFILE_CONTROL) as control_file:
+                    control = json.load(control_file)
+                rate = float(control.get('rate', rate))
+                mode = control.get('mode', mode)
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                print('IGNORING PROFILE CONTROL FILE')
+                print(e)
+        _settings.update(rate=rate, mode=mode if mode in MODES else 'sample')
+    return _settings
+
+
+def wanted(headers):
+    """Returns whether to profile a request: a valid X-Profile-Token, or the sample rate."""
+    token = headers.get('X-Profile-Token')
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    rate = settings()['rate']
+    return rate > 0 and random.random() < rate
+
+
+class StackSampler(object):
+    """Records the stack of one thread every interval seconds from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(
+                    code.co_name, os.path.basename(code.co_filename), code.co_firstlineno
+                ))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        """Writes the samples in the collapsed format flamegraph.pl and speedscope read."""
+        with open(path, 'w') as collapsed:
+            for stack, count in self.stacks.most_common():
+                collapsed.write('{} {}\n'.format(stack, count))
+
+
+class ProfiledCall(object):
+    """Profiles the current thread until finish() writes the result under PROFILE_DIR."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        if mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:
+                # Python 3.12+ allows one cProfile at a time per process; sample instead
+                self.mode = 'sample'
+        if self.mode == 'sample':
+            self._profile = StackSampler(threading.get_ident(), PROFILE_INTERVAL)
+            self._profile.start()
+
+    def finish(self, route):
+        """Stops profiling and returns the path of the .pstats or .collapsed file."""
+        if self.mode == 'cprofile':
+            self._profile.disable()
+        else:
+            self._profile.stop()
+
+        route_dir = os.path.join(PROFILE_DIR, route.replace(os.sep, '_'))
+        if not os.path.isdir(route_dir):
+            os.makedirs(route_dir, exist_ok=True)
+        path = os.path.join(route_dir, '{}-{}-{}.{}'.format(
+            datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S'), os.getpid(),
+            next(_file_numbers), 'pstats' if self.mode == 'cprofile' else 'collapsed'
+        ))
+        if self.mode == 'cprofile':
+            self._profile.dump_stats(path)
+        else:
+            self._profile.write(path)
+        return path
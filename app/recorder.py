@@ -0,0 +1,66 @@
+import json
+import logging
+import logging.handlers
+import time
+
+from config import TRAFFIC_LOG, TRAFFIC_LOG_BYTES, TRAFFIC_LOG_BACKUPS
+
+
+REDACTED = '<redacted>'
+SECRET_FIELDS = ('password', 'secret', 'token')
+
+_logger = None
+
+
+def _traffic_logger():
+    """Returns the logger that appends one JSON request record per line to TRAFFIC_LOG."""
+    global _logger
+    if _logger is None:
+        handler = logging.handlers.RotatingFileHandler(
+            TRAFFIC_LOG, maxBytes=TRAFFIC_LOG_BYTES, backupCount=TRAFFIC_LOG_BACKUPS
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger = logging.getLogger('lost.traffic')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        _logger = logger
+    return _logger
+
+
+def _is_secret(name):
+    name = str(name).lower()
+    return any(field in name for field in SECRET_FIELDS)
+
+
+def sanitise(value):
+    """Returns value with every password, secret or token field replaced by REDACTED.
+
+    Form fields holding JSON (the REST API's 'arguments') are sanitised inside too.
+    """
+    if isinstance(value, dict):
+        return {name: REDACTED if _is_secret(name) else sanitise(field)
+                for name, field in value.items()}
+    if isinstance(value, list):
+        return [sanitise(item) for item in value]
+    if isinstance(value, str) and value[:1] in ('{', '['):
+        try:
+            return json.dumps(sanitise(json.loads(value)))
+        except ValueError:
+            return value
+    return value
+
+
+def record(request, role, status, seconds):
+    """Appends one request to TRAFFIC_LOG: enough to replay it, with secrets removed."""
+    _traffic_logger().info(json.dumps({
+        'at': time.time(),
+        'route': request.endpoint or 'unmatched',
+        'method': request.method,
+        'path': request.path,
+        'args': sanitise(request.args.to_dict()),
+        'form': sanitise(request.form.to_dict()),
+        'role': role,  # Replay sends it from a session logged in with this role
+        'status': status,
+        'seconds': round(seconds, 6),
+    }))
@@ -1,34 +1,134 @@
 from flask import request, flash, url_for, redirect, render_template
+from psycopg2.extras import execute_values
 
 from app import app, helpers
 
 
+# Current assets table, one page at a time seeking on (asset_tag, asset_pk)
+all_assets_query = ("SELECT assets.asset_tag, assets.description, facilities.location, "
+                    "assets.asset_tag, assets.asset_pk "
+                    "FROM assets "
+                    "JOIN asset_current ON assets.asset_pk = asset_current.asset_fk "
+                    "JOIN facilities ON asset_current.facility_fk = facilities.facility_pk "
+                    "WHERE {keyset} {order};")
+asset_keys = ['assets.asset_tag', 'assets.asset_pk']
+
+
+def _assets_page():
+    """Returns the page of the assets table picked by the request's after/before cursors."""
+    try:
+        return helpers.keyset_page(all_assets_query, [], asset_keys,
+                                   after=request.args.get('after'),
+                                   before=request.args.get('before'))
+    except ValueError:
+        flash('That page of assets could not be found. Showing the first page.')
+        return helpers.keyset_page(all_assets_query, [], asset_keys)
+
+
+# Bulk intake: the CSV is streamed into a temp table, tags already in use are dropped with
+# one join, and one statement inserts the assets and pairs them with their asset_at rows
+INTAKE_COLUMNS = ['asset_tag', 'description', 'facility', 'date']
+INTAKE_BATCH = 1000  # Rows sent per INSERT while the file is read
+stage_intake = ("CREATE TEMP TABLE intake ("
+                "row_no INTEGER PRIMARY KEY, asset_tag VARCHAR(16) UNIQUE, description TEXT, "
+                "facility_fk INTEGER, arrive_dt TIMESTAMP"
+                ") ON COMMIT DROP;")
+insert_intake = ("INSERT INTO intake (row_no, asset_tag, description, facility_fk, arrive_dt) "
+                 "VALUES %s;")
+drop_existing_tags = ("DELETE FROM intake as i USING assets as a "
+                      "WHERE a.asset_tag = i.asset_tag RETURNING i.row_no, i.asset_tag;")
+insert_intake_assets = ("WITH new_assets AS ("
+                        "INSERT INTO assets (asset_tag, description, disposed) "
+                        "SELECT asset_tag, description, FALSE FROM intake ORDER BY row_no "
+                        "RETURNING asset_pk, asset_tag"
+                        ") INSERT INTO asset_at (asset_fk, facility_fk, arrive_dt) "
+                        "SELECT n.asset_pk, i.facility_fk, i.arrive_dt "
+                        "FROM new_assets as n JOIN intake as i ON i.asset_tag = n.asset_tag;")
+
+
+def _intake_row(row, facilities, tags_seen):
+    """Returns (asset_tag, description, facility_fk, arrive_dt) for a CSV row, or an error."""
+    asset_tag, description = row['asset_tag'], row['description']
+    if not asset_tag or not description or not row['facility'] or not row['date']:
+        return 'Missing a column'
+    if len(asset_tag) > 16:
+        return 'Asset tag is longer than 16 characters'
+    if asset_tag in tags_seen:
+        return 'Asset tag appears earlier in the file'
+    if row['facility'] not in facilities:
+        return 'Unknown facility code'
+    try:
+        arrive_dt = helpers.validate_date(row['date'])
+    except ValueError:
+        return 'Date is not in the MM/DD/YYYY format'
+    return asset_tag, description, facilities[row['facility']], arrive_dt
+
+
+def add_assets_from_csv(upload):
+    """Adds every valid asset in an uploaded CSV in one transaction.
+
+    Returns (assets added, [(row, asset_tag, reason) for each row skipped]). Raises
+    ValueError if the file cannot be read, in which case nothing is added.
+    """
+    facilities = dict((facility[1], facility[0]) for facility in helpers.get_facilities() or [])
+    skipped, tags_seen, batch = [], set(), []
+
+    with helpers.transaction() as cur:
+        cur.execute(stage_intake)
+        for row_no, row in enumerate(helpers.iter_csv_upload(upload, INTAKE_COLUMNS), 1):
+            intake = _intake_row(row, facilities, tags_seen)
+            if isinstance(intake, str):
+                skipped.append((row_no, row['asset_tag'], intake))
+                continue
+            tags_seen.add(intake[0])
+            batch.append((row_no,) + intake)
+            if len(batch) >= INTAKE_BATCH:
+                execute_values(cur, insert_intake, batch, page_size=INTAKE_BATCH)
+                batch = []
+        if batch:
+            execute_values(cur, insert_intake, batch, page_size=INTAKE_BATCH)
+
+        cur.execute("ANALYZE intake;")
+        cur.execute(drop_existing_tags)
+        skipped.extend((row_no, asset_tag, 'There already exists an asset with that tag')
+                       for row_no, asset_tag in cur.fetchall())
+        cur.execute(insert_intake_assets)
+        added = cur.rowcount
+
+    skipped.sort()
+    return added, skipped
+
+
 @app.route('/add_asset', methods=['GET', 'POST'])
 def add_asset():
-    # Create queries to populate dropdown menu and current assets table
-    all_assets_query = ("SELECT assets.asset_tag, assets.description, facilities.location "
-                        "FROM assets "
-                        "JOIN asset_at ON assets.asset_pk = asset_at.asset_fk "
-                        "JOIN facilities ON asset_at.facility_fk = facilities.facility_pk;")
-    all_facilities_query = "SELECT * FROM facilities;"
-
-    if request.method == 'POST':
+    skipped = None
+    if request.method == 'POST' and request.files.get('assets_file'):
+        try:
+            added, skipped = add_assets_from_csv(request.files['assets_file'])
+            flash('{} new assets added! {} rows skipped.'.format(added, len(skipped)))
+        except ValueError as e:
+            flash(str(e))
+        except helpers.TransactionFailed:
+            flash('The assets could not be added. No changes were saved.')
+
+    elif request.method == 'POST':
         asset_tag = request.form.get('asset_tag', None).strip()
         description = request.form.get('description', None)
         facility = request.form.get('facility')
         date = request.form.get('date')
         disposed = False
 
-        # Get all current assets and facilities for table/drop-down population
-        all_assets = helpers.db_query(all_assets_query, [])
-        all_facilities = helpers.db_query(all_facilities_query, [])
+        # Get a page of current assets and all facilities for table/drop-down population
+        page = _assets_page()
+        all_assets = page['rows']
+        all_facilities = helpers.get_facilities()
 
         if all_facilities is None:
             flash('You must add facilities before you can get asset reports.')
             return redirect(url_for('dashboard'))
 
         # Handle table when no assets in database
-        if all_assets is None:
+        if not all_assets:
             all_assets = [
                 ('NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES')
             ]
@@ -37,7 +137,8 @@ def add_asset():
         if not asset_tag or not description or not date or facility == '':
             flash('Please complete the form')
             return render_template(
-                'add_asset.html', assets_list=all_assets, facilities_list=all_facilities
+                'add_asset.html', assets_list=all_assets, facilities_list=all_facilities,
+                page=page, intake_columns=INTAKE_COLUMNS
             )
         else:
             try:
@@ -45,7 +146,8 @@ def add_asset():
             except ValueError or TypeError or UnboundLocalError:
                 flash('Please enter the date in the following format: MM/DD/YYYY')
                 return render_template(
-                    'add_asset.html', assets_list=all_assets, facilities_list=all_facilities
+                    'add_asset.html', assets_list=all_assets, facilities_list=all_facilities,
+                    page=page, intake_columns=INTAKE_COLUMNS
                 )
 
             # Check for duplicate entry attempt...
@@ -55,34 +157,34 @@ def add_asset():
             if asset_does_exist:
                 flash('There already exists an asset with that tag!')
             else:
-                # Asset does not already exist - create it...
+                # Asset does not already exist - create it and its asset_at record together
                 new_asset = ("INSERT INTO assets (asset_tag, description, disposed) "
-                             "VALUES (%s, %s, %s);")
-                helpers.db_change(new_asset, [asset_tag, description, disposed])
-
-                # Get Asset Key for asset_at insertion
-                recently_added_asset = "SELECT asset_pk FROM assets WHERE asset_tag = %s;"
-                asset_fk = helpers.db_query(recently_added_asset, [asset_tag])
-
-                # Insert asset_at record for newly added asset
+                             "VALUES (%s, %s, %s) RETURNING asset_pk;")
                 new_asset_at = ("INSERT INTO asset_at (asset_fk, facility_fk, arrive_dt) "
                                 "VALUES (%s, %s, %s);")
-                helpers.db_change(new_asset_at, [asset_fk[0][0], facility, validated_date])
-
-                flash('New asset added!')
+                try:
+                    with helpers.transaction() as cur:
+                        cur.execute(new_asset, [asset_tag, description, disposed])
+                        asset_fk = cur.fetchone()[0]
+                        cur.execute(new_asset_at, [asset_fk, facility, validated_date])
+                    flash('New asset added!')
+                except helpers.TransactionFailed:
+                    flash('The asset could not be added. No changes were saved.')
 
     # Get Facilities for dropdown
-    all_facilities = helpers.db_query(all_facilities_query, [])
+    all_facilities = helpers.get_facilities()
     if all_facilities is None:
         flash('You must add facilities before you can get asset reports.')
         return redirect(url_for('dashboard'))
 
     # Update all_assets after insert, but before template rendering
-    all_assets = helpers.db_query(all_assets_query, [])
+    page = _assets_page()
+    all_assets = page['rows']
 
     # Handle situation of no assets in database
-    if all_assets is None:
+    if not all_assets:
         all_assets = [('NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES')]
 
-    return render_template('add_asset.html', assets_list=all_assets, facilities_list=all_facilities)
+    return render_template('add_asset.html', assets_list=all_assets, facilities_list=all_facilities,
+                           page=page, skipped=skipped, intake_columns=INTAKE_COLUMNS)
 
@@ -11,7 +11,7 @@ def add_facility():
         location = request.form.get('location', None)
 
         # Get all current facilities for table population
-        all_facilities = helpers.db_query("SELECT * FROM facilities;", [])
+        all_facilities = helpers.get_facilities()
 
         # If something is missing from the form...
         if not fcode or not common_name or not location:
@@ -32,11 +32,17 @@ def add_facility():
             else:
                 new_facility = ("INSERT INTO facilities (fcode, common_name, location) "
                                 "VALUES (%s, %s, %s);")
-                helpers.db_change(new_facility, [fcode, common_name, location])
-                flash('New facility was created!')
+                try:
+                    with helpers.transaction() as cur:
+                        cur.execute(new_facility, [fcode, common_name, location])
+                        # Every worker re-reads the facility list once this commits
+                        helpers.invalidate_facilities(cur)
+                    flash('New facility was created!')
+                except helpers.TransactionFailed:
+                    flash('The facility could not be created. No changes were saved.')
 
     # Update all_facilities after insert, but before template rendering
-    all_facilities = helpers.db_query("SELECT * FROM facilities;", [])
+    all_facilities = helpers.get_facilities()
 
     # Database doesn't have any facilities yet.
     if all_facilities is None:
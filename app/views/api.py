@@ -1,78 +1,203 @@
 from flask import request, json
+from psycopg2.extras import execute_values
+import functools
+import hmac
 
 from app import app, helpers
 
 
+ROLES = {'logofc': 2, 'facofc': 3}
+existing_users = "SELECT username FROM users WHERE username = ANY(%s);"
+reactivate_users = "UPDATE users SET active = TRUE WHERE username = ANY(%s) RETURNING username;"
+insert_users = ("INSERT INTO users (role_fk, username, password, salt, active) "
+                "VALUES %s "
+                "ON CONFLICT (username) DO UPDATE SET active = TRUE "
+                "RETURNING username, xmax = 0;")
+
+
+def require_api_token(view):
+    """Returns view guarded so it only runs for requests carrying the configured API_TOKEN."""
+    @functools.wraps(view)
+    def guarded(*args, **kwargs):
+        token = request.headers.get('X-API-Token')
+        expected = app.config['API_TOKEN']
+        if not token or not expected or not hmac.compare_digest(token, expected):
+            return json.dumps({'result': 'Error: Not Authorized'}), 403
+        return view(*args, **kwargs)
+    return guarded
+
+
+def _activation_error(api_req):
+    """Returns the API error for one activate request, or none if it is valid."""
+    if 'username' not in api_req or 'password' not in api_req or 'role' not in api_req:
+        return 'Error: Missing Parameters'
+    if len(api_req['username']) > 16 or len(api_req['password']) > 16:
+        return 'Error: Username or Password Too Long'
+    if api_req['role'] not in ROLES:
+        return 'Error: Unsupported Role'
+    return None
+
+
+def create_users(new_users):
+    """Hashes and inserts (role_fk, username, password) users; returns {username: created}.
+
+    A username taken since the caller looked is only re-activated, never overwritten.
+    """
+    hashes = helpers.hash_passwords([password for _, _, password in new_users])
+    rows = [(role_fk, username, password, salt)
+            for (role_fk, username, _), (password, salt) in zip(new_users, hashes)]
+    with helpers.transaction() as cur:
+        # One page, so RETURNING covers every row
+        execute_values(cur, insert_users, rows, template='(%s, %s, %s, %s, TRUE)',
+                       page_size=len(rows))
+        created = dict(cur.fetchall())
+    return created
+
+
+def _create_users_later(new_users):
+    # Runs on the background thread, where nobody is waiting for the outcome
+    try:
+        create_users(new_users)
+    except Exception as e:
+        print('API USER BATCH FAILED: {} users not created'.format(len(new_users)))
+        print(e)
+
+
+def activate_users(api_reqs, in_background=False):
+    """Creates or re-activates a batch of users; returns a result per user.
+
+    An existing user keeps their password and salt and is re-activated at once. New users'
+    passwords are hashed inline, or with in_background on the background thread, in which
+    case their result is 'Queued'.
+    """
+    results = [{'username': api_req.get('username'), 'result': _activation_error(api_req)}
+               for api_req in api_reqs]
+
+    # A username may only be written once per statement, so the last request for it wins
+    latest = {}
+    for index, api_req in enumerate(api_reqs):
+        if results[index]['result'] is None:
+            latest[api_req['username']] = index
+    for index, result in enumerate(results):
+        if result['result'] is None and latest[result['username']] != index:
+            result['result'] = 'Error: Superseded Later In Batch'
+
+    to_write = sorted(latest.values())
+    if not to_write:
+        return results
+
+    existing = set(row[0] for row in helpers.db_query(existing_users, [list(latest)]) or [])
+    new_users = [(ROLES[api_reqs[index]['role']], api_reqs[index]['username'],
+                  api_reqs[index]['password'])
+                 for index in to_write if api_reqs[index]['username'] not in existing]
+
+    created = {}
+    try:
+        if existing:
+            with helpers.transaction() as cur:
+                cur.execute(reactivate_users, [list(existing)])
+                created.update((row[0], False) for row in cur.fetchall())
+        if new_users and in_background:
+            helpers.run_later(_create_users_later, new_users)
+        elif new_users:
+            created.update(create_users(new_users))
+    except helpers.TransactionFailed:
+        created = None
+
+    for index in to_write:
+        username = api_reqs[index]['username']
+        if created is None:
+            results[index]['result'] = 'Error: Batch Rolled Back'
+        elif in_background and username not in existing:
+            results[index]['result'] = 'Queued'
+        elif username not in created:
+            # Deleted between the lookup and the update
+            results[index]['result'] = 'Error: User Not Found'
+        else:
+            results[index]['result'] = 'OK'
+            results[index]['created'] = created[username]
+
+    return results
+
+
+def revoke_users(usernames):
+    """Deactivates a batch of users in one statement; returns a result per username."""
+    deactivate_users = ("UPDATE users SET active = FALSE "
+                        "WHERE username = ANY(%s) RETURNING username;")
+    try:
+        with helpers.transaction() as cur:
+            cur.execute(deactivate_users, [list(usernames)])
+            revoked = set(row[0] for row in cur.fetchall())
+    except helpers.TransactionFailed:
+        return [{'username': username, 'result': 'Error: Batch Rolled Back'}
+                for username in usernames]
+
+    return [{'username': username,
+             'result': 'OK' if username in revoked else 'Error: User Not Found'}
+            for username in usernames]
+
+
 @app.route('/rest/activate_user', methods=['POST'])
+@require_api_token
 def activate_user():
     if request.method == 'POST' and 'arguments' in request.form:
         api_req = json.loads(request.form['arguments'])
 
-        # If http request is missing a parameter...
-        if 'username' not in api_req or 'password' not in api_req or 'role' not in api_req:
-            error_result = json.dumps({'result': 'Error: Missing Parameters'})
-            return error_result
-        else:
-            username = api_req['username']
-            password = api_req['password']
-            role = api_req['role']
+        # A single activation is a batch of one
+        result = activate_users([api_req])[0]['result']
+        return json.dumps({'result': result})
 
-        # Handle errors within CLI arguments.
-        if len(username) > 16 or len(password) > 16:
-            error_result = json.dumps({'result': 'Error: Username or Password Too Long'})
-            return error_result
 
-        # All parameters are valid.
-        if role == 'logofc':
-            role = 2
-        elif role == 'facofc':  # facofc
-            role = 3
-        else:
-            error_result = json.dumps({'result': 'Error: Unsupported Role'})
-            return error_result
-
-        matching_user = "SELECT * FROM users WHERE username = %s"
-        user_does_exist = helpers.db_query(matching_user, [username])
+@app.route('/rest/activate_users', methods=['POST'])
+@require_api_token
+def activate_user_batch():
+    if request.method == 'POST' and 'arguments' in request.form:
+        api_reqs = json.loads(request.form['arguments'])
 
-        # If user exists in database, activate user; otherwise, create and activate new user.
-        if user_does_exist:
-            activate_existing_user = ("UPDATE users SET password = %s, active = TRUE "
-                                      "WHERE username = %s")
-            helpers.db_change(activate_existing_user, [password, username])
-        else:
-            create_user = ("INSERT INTO users (user_pk, role_fk, username, password, active) "
-                           "VALUES (DEFAULT, %s, %s, %s, TRUE)")
-            helpers.db_change(create_user, [role, username, password])
+        # Expecting a list of {username, password, role} objects
+        if not isinstance(api_reqs, list) or not all(isinstance(r, dict) for r in api_reqs):
+            error_result = json.dumps({'result': 'Error: Expected A List Of Users'})
+            return error_result
+        if len(api_reqs) > app.config['API_MAX_BATCH']:
+            error_result = json.dumps({'result': 'Error: Batch Too Large'})
+            return error_result
 
-        data = json.dumps({'result': 'OK'})
-        return data
+        # New users are hashed off the request thread, so a large sync returns at once
+        return json.dumps({'result': 'OK', 'users': activate_users(api_reqs, in_background=True)})
 
 
 @app.route('/rest/revoke_user', methods=['POST'])
+@require_api_token
 def revoke_user():
     if request.method == 'POST' and 'arguments' in request.form:
         api_req = json.loads(request.form['arguments'])
-        print('This is the api_req', api_req)
 
         # If http request is missing a parameter...
         if 'username' not in api_req:
             error_result = json.dumps({'result': 'Error: Missing Parameter(s)'})
             return error_result
 
-        # All parameters present in request.
-        username = api_req['username']
+        # A single revocation is a batch of one
+        result = revoke_users([api_req['username']])[0]['result']
+        return json.dumps({'result': result})
 
-        matching_user = "SELECT * FROM users WHERE username = %s"
-        user_does_exist = helpers.db_query(matching_user, [username])
 
-        # If user exists in database, deactivate user; otherwise, return "User Not Found" API Error.
-        if user_does_exist:
-            deactivate_existing_user = ("UPDATE users SET active = FALSE "
-                                        "WHERE username = %s")
-            helpers.db_change(deactivate_existing_user, [username])
+@app.route('/rest/revoke_users', methods=['POST'])
+@require_api_token
+def revoke_user_batch():
+    if request.method == 'POST' and 'arguments' in request.form:
+        api_req = json.loads(request.form['arguments'])
 
-            data = json.dumps({'result': 'OK'})
-            return data
-        else:
-            error_result = json.dumps({'result': 'Error: User Not Found'})
+        # Expecting a list of usernames, or a list of {username} objects
+        if not isinstance(api_req, list):
+            error_result = json.dumps({'result': 'Error: Expected A List Of Users'})
+            return error_result
+        if len(api_req) > app.config['API_MAX_BATCH']:
+            error_result = json.dumps({'result': 'Error: Batch Too Large'})
             return error_result
+        usernames = [r.get('username') if isinstance(r, dict) else r for r in api_req]
+        if not all(isinstance(username, str) for username in usernames):
+            error_result = json.dumps({'result': 'Error: Missing Parameter(s)'})
+            return error_result
+
+        return json.dumps({'result': 'OK', 'users': revoke_users(usernames)})
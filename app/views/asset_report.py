@@ -1,23 +1,115 @@
-from flask import request, flash, redirect, url_for, render_template
+from flask import request, flash, redirect, url_for, render_template, session, json, Response
+import csv
+import io
 
 from app import app, helpers
 
 
+# Report rows are paged by seeking on (asset_tag, asset_pk, arrive_dt)
+all_assets_report = ("SELECT a.asset_tag, a.description, f.location, "
+                     "a_a.arrive_dt, a_a.depart_dt, "
+                     "a.asset_tag, a.asset_pk, a_a.arrive_dt FROM assets as a "
+                     "JOIN asset_at as a_a ON a.asset_pk = a_a.asset_fk "
+                     "JOIN facilities as f ON a_a.facility_fk = f.facility_pk "
+                     "WHERE a_a.valid_during @> %s::timestamp AND {keyset} {order};")
+individual_facility_report = ("SELECT a.asset_tag, a.description, "
+                              "f.location, a_a.arrive_dt, a_a.depart_dt, "
+                              "a.asset_tag, a.asset_pk, a_a.arrive_dt "
+                              "FROM assets as a "
+                              "JOIN asset_at as a_a ON a.asset_pk = a_a.asset_fk "
+                              "JOIN ("
+                              "SELECT facility_pk, location FROM facilities "
+                              "WHERE facility_pk = %s"
+                              ") as f ON f.facility_pk = a_a.facility_fk "
+                              "WHERE a_a.valid_during @> %s::timestamp AND {keyset} {order};")
+report_keys = ['a.asset_tag', 'a.asset_pk', 'a_a.arrive_dt']
+
+
+def _report_page(sql, data_list):
+    """Returns the page of a report picked by the request's after/before cursors."""
+    try:
+        return helpers.keyset_page(sql, data_list, report_keys,
+                                   after=request.args.get('after'),
+                                   before=request.args.get('before'))
+    except ValueError:
+        flash('That page of the report could not be found. Showing the first page.')
+        return helpers.keyset_page(sql, data_list, report_keys)
+
+
+report_columns = ['asset_tag', 'description', 'location', 'arrive_dt', 'depart_dt']
+report_order = 'ORDER BY a.asset_tag, a.asset_pk, a_a.arrive_dt'
+export_types = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def _export_rows(sql, data_list, export_format):
+    """Yields a whole report as CSV or NDJSON text, in chunks of about 64KB."""
+    rows = helpers.stream_query(sql.format(keyset='TRUE', order=report_order), data_list)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == 'csv':
+        writer.writerow(report_columns)
+        yield buffer.getvalue()  # Send the header before the first row has been fetched
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        # The trailing columns are the pagination keys
+        values = row[:len(report_columns)]
+        if export_format == 'csv':
+            writer.writerow(values)
+        else:
+            record = dict(zip(report_columns, values))
+            record['arrive_dt'] = record['arrive_dt'] and record['arrive_dt'].isoformat()
+            record['depart_dt'] = record['depart_dt'] and record['depart_dt'].isoformat()
+            buffer.write(json.dumps(record) + '\n')
+        if buffer.tell() > 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _export_report(sql, data_list, export_format, validated_date):
+    """Returns a streamed download of a report instead of an HTML page."""
+    filename = 'asset_report_{}.{}'.format(validated_date.isoformat(), export_format)
+    return Response(_export_rows(sql, data_list, export_format),
+                    mimetype=export_types[export_format],
+                    headers={'Content-Disposition': 'attachment; filename=' + filename})
+
+
 @app.route('/asset_report', methods=['GET', 'POST'])
 def asset_report():
-    all_facilities_query = "SELECT * FROM facilities;"
-
-    # If a form has been submitted...
-    if request.method == 'POST':
+    # If a form has been submitted, or a page link of an earlier report followed...
+    if request.method == 'POST' or request.args.get('date') or request.args.get('format'):
         # List of single-tuples of all facilities to populate drop-down
-        all_facilities = helpers.db_query(all_facilities_query, [])
+        all_facilities = helpers.get_facilities()
         if all_facilities is None:
             flash('You must add facilities before you can get asset reports.')
             return redirect(url_for('dashboard'))
 
-        # User Input from Form
-        facility = request.form.get('facility')
-        date = request.form.get('date')
+        # User Input from Form (or from the page link's query string)
+        facility = request.values.get('facility', 'All')
+        date = request.values.get('date')
+        page_args = {'facility': facility, 'date': date}
+        export_format = request.values.get('format')
+
+        # Downloads hold no flash messages, so anything but a complete request is refused
+        if export_format:
+            if not session.get('logged_in'):
+                return redirect(url_for('login'))
+            if export_format not in export_types:
+                return 'Unsupported format: use csv or ndjson\n', 400
+            try:
+                validated_date = helpers.validate_date(date)
+            except (ValueError, TypeError):
+                return 'Please give the date in the following format: MM/DD/YYYY\n', 400
+            if facility != 'All' and not facility.isdigit():
+                return 'Unknown facility: use a facility_pk or All\n', 400
+            if facility == 'All':
+                return _export_report(all_assets_report, [validated_date], export_format,
+                                      validated_date)
+            return _export_report(individual_facility_report, [facility, validated_date],
+                                  export_format, validated_date)
 
         # Validate Inputs
         if not date:
@@ -37,18 +129,11 @@ def asset_report():
 
         # Get all assets at all facilities
         if facility == 'All':
-            all_assets_report = ("SELECT a.asset_tag, a.description, f.location, "
-                                 "a_a.arrive_dt, a_a.depart_dt FROM assets as a "
-                                 "JOIN asset_at as a_a ON a.asset_pk = a_a.asset_fk "
-                                 "JOIN facilities as f ON a_a.facility_fk = f.facility_pk "
-                                 "WHERE (a_a.depart_dt >= %s OR a_a.depart_dt IS NULL) "
-                                 "AND a_a.arrive_dt <= %s;")
-            all_assets = helpers.db_query(
-                all_assets_report, [validated_date, validated_date]
-            )
+            page = _report_page(all_assets_report, [validated_date])
+            all_assets = page['rows']
 
             # No Results
-            if all_assets is None:
+            if not all_assets:
                 all_assets = [(
                     'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES'
                 )]
@@ -58,27 +143,17 @@ def asset_report():
 
             return render_template(
                 'asset_report.html', facility=facility, date=validated_date,
-                assets_list=all_assets, facilities_list=all_facilities, report=True
+                assets_list=all_assets, facilities_list=all_facilities, report=True,
+                page=page, page_args=page_args
             )
 
         # Get all assets at a specific facility
         else:
-            individual_facility_report = ("SELECT a.asset_tag, a.description, "
-                                          "f.location, a_a.arrive_dt, a_a.depart_dt "
-                                          "FROM assets as a "
-                                          "JOIN asset_at as a_a ON a.asset_pk = a_a.asset_fk "
-                                          "JOIN ("
-                                          "SELECT facility_pk, location FROM facilities "
-                                          "WHERE facility_pk = %s"
-                                          ") as f ON f.facility_pk = a_a.facility_fk "
-                                          "WHERE (a_a.depart_dt >= %s OR a_a.depart_dt IS NULL) "
-                                          "AND a_a.arrive_dt <= %s;")
-            filtered_assets = helpers.db_query(
-                individual_facility_report, [facility, validated_date, validated_date]
-            )
+            page = _report_page(individual_facility_report, [facility, validated_date])
+            filtered_assets = page['rows']
 
             # No Results
-            if filtered_assets is None:
+            if not filtered_assets:
                 filtered_assets = [(
                     'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES'
                 )]
@@ -88,10 +163,10 @@ def asset_report():
 
             return render_template('asset_report.html', facility=facility, date=validated_date,
                                    assets_list=filtered_assets, facilities_list=all_facilities,
-                                   report=True)
+                                   report=True, page=page, page_args=page_args)
 
     # List of single-tuples of all facilities to populate drop-down
-    all_facilities = helpers.db_query(all_facilities_query, [])
+    all_facilities = helpers.get_facilities()
     if all_facilities is None:
         flash('You must add facilities to the database before you can get asset reports.')
         return redirect(url_for('dashboard'))
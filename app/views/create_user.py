@@ -1,6 +1,5 @@
 from flask import request, flash, render_template
 import re
-import bcrypt
 
 from app import app, helpers
 
@@ -20,8 +19,7 @@ def create_user():
             if user_does_exist:
                 flash('Username already exists')
             else:
-                salt = bcrypt.gensalt(12)
-                password = bcrypt.hashpw(password.encode('utf-8'), bytes(salt))
+                password, salt = helpers.hash_password(password)
                 new_user = ("INSERT INTO users (username, password, salt, role_fk) "
                             "VALUES (%s, %s, %s, %s);")
                 helpers.db_change(new_user, [username, password, salt, role])
@@ -31,99 +31,81 @@ def dashboard():
                 flash('Please at least fill in a load date.')
                 return redirect(url_for('dashboard'))
 
+            # The asset's current stay is the one a load date ends
             selected_request_query = ("SELECT "
-                                      "r.request_pk, r.asset_fk, r.src_fk, r.dest_fk, aa.arrive_dt "
+                                      "r.request_pk, r.asset_fk, r.src_fk, r.dest_fk, c.arrive_dt "
                                       "FROM requests as r "
-                                      "JOIN asset_at as aa ON r.asset_fk = aa.asset_fk "
+                                      "JOIN asset_current as c ON r.asset_fk = c.asset_fk "
                                       "WHERE request_pk = %s;")
-            selected_request_record = helpers.db_query(selected_request_query, [selected_request])
-
-            # Both load and unload date submitted
-            if load_date and unload_date:
-                # Impossible use case
-                if load_date > unload_date:
-                    flash(
-                        'It is not possible for an asset to be loaded after '
-                        'it was unloaded. Make sure you entered your '
-                        'dates correctly.'
-                    )
-                else:
-                    # Check for logical dates...
-                    transit_update = ("UPDATE in_transit SET load_dt = %s, unload_dt = %s "
-                                      "WHERE request_fk = %s;")
-                    helpers.db_change(transit_update, [
-                        load_date, unload_date, selected_request]
-                    )
-
-                    update_asset_at = ("UPDATE asset_at SET depart_dt = %s "
-                                       "WHERE asset_fk = %s AND arrive_dt = %s;")
-                    helpers.db_change(update_asset_at, [
-                        load_date, selected_request_record[0][1], selected_request_record[0][4]]
-                    )
-
-                    new_asset_at = ("INSERT INTO asset_at (asset_fk, facility_fk, arrive_dt) "
-                                    "VALUES (%s, %s, %s);")
-                    helpers.db_change(new_asset_at, [
-                        selected_request_record[0][1], selected_request_record[0][3], unload_date]
-                    )
-
-                    update_request = "UPDATE requests SET completed = TRUE WHERE request_pk = %s;"
-                    helpers.db_change(update_request, [
-                        selected_request]
-                    )
-
-                    flash('Transfer Completed - Request Completed')
-
-            # Updating only load date
-            elif load_date and not unload_date:
-                transit_update = "UPDATE in_transit SET load_dt = %s WHERE request_fk = %s;"
-                helpers.db_change(transit_update, [
-                        load_date, selected_request]
-                )
-
-                update_asset_at = ("UPDATE asset_at SET depart_dt = %s "
-                                   "WHERE asset_fk = %s AND arrive_dt = %s;")
-                helpers.db_change(update_asset_at, [
-                        load_date, selected_request_record[0][1], selected_request_record[0][4]]
-                )
-
-                flash('Load Date Updated')
-
-            # Attempting to only update unload date
-            else:
-                load_date = """
-                SELECT r.request_pk, t.load_dt FROM requests as r
-                JOIN in_transit as t ON r.request_pk = t.request_fk
-                WHERE r.approved = TRUE AND r.request_pk = %s;
-                """
-                lo_requests = helpers.db_query(load_date, [selected_request])
-
-                # There is no load date for this asset
-                if not lo_requests[0][1]:
-                    flash('The asset must be loaded before it can be unloaded.')
-
-                # There is a load date for this asset-in-transit
-                else:
-                    transit_update = "UPDATE in_transit SET unload_dt = %s WHERE request_fk = %s;"
-                    helpers.db_change(transit_update, [
-                            unload_date, selected_request]
-                    )
-
-                    new_asset_at = ("INSERT INTO asset_at (asset_fk, facility_fk, arrive_dt) "
-                                    "VALUES (%s, %s, %s);")
-                    helpers.db_change(new_asset_at, [
-                            selected_request_record[0][1],
-                            selected_request_record[0][3],
-                            unload_date
-                        ]
-                    )
-
-                    update_request = "UPDATE requests SET completed = TRUE WHERE request_pk = %s;"
-                    helpers.db_change(update_request, [
-                            selected_request]
-                    )
-
-                    flash('Unload Date Updated! Transfer Completed - Request Completed')
+            load_date_query = """
+            SELECT r.request_pk, t.load_dt FROM requests as r
+            JOIN in_transit as t ON r.request_pk = t.request_fk
+            WHERE r.approved = TRUE AND r.request_pk = %s;
+            """
+            transit_update = ("UPDATE in_transit SET load_dt = %s, unload_dt = %s "
+                              "WHERE request_fk = %s;")
+            transit_load_update = "UPDATE in_transit SET load_dt = %s WHERE request_fk = %s;"
+            transit_unload_update = "UPDATE in_transit SET unload_dt = %s WHERE request_fk = %s;"
+            update_asset_at = ("UPDATE asset_at SET depart_dt = %s "
+                               "WHERE asset_fk = %s AND arrive_dt = %s;")
+            new_asset_at = ("INSERT INTO asset_at (asset_fk, facility_fk, arrive_dt) "
+                            "VALUES (%s, %s, %s);")
+            update_request = "UPDATE requests SET completed = TRUE WHERE request_pk = %s;"
+            message = None
+
+            # Every update for this request is committed together or not at all
+            try:
+                with helpers.transaction() as cur:
+                    cur.execute(selected_request_query, [selected_request])
+                    record = cur.fetchone()
+
+                    # Request gone, or its asset has no current location
+                    if record is None:
+                        message = 'That request could not be found. Please choose another.'
+
+                    # Both load and unload date submitted
+                    elif load_date and unload_date:
+                        # Impossible use case
+                        if load_date > unload_date:
+                            message = (
+                                'It is not possible for an asset to be loaded after '
+                                'it was unloaded. Make sure you entered your '
+                                'dates correctly.'
+                            )
+                        else:
+                            # Check for logical dates...
+                            cur.execute(transit_update, [load_date, unload_date, selected_request])
+                            cur.execute(update_asset_at, [load_date, record[1], record[4]])
+                            cur.execute(new_asset_at, [record[1], record[3], unload_date])
+                            cur.execute(update_request, [selected_request])
+                            message = 'Transfer Completed - Request Completed'
+
+                    # Updating only load date
+                    elif load_date and not unload_date:
+                        cur.execute(transit_load_update, [load_date, selected_request])
+                        cur.execute(update_asset_at, [load_date, record[1], record[4]])
+                        message = 'Load Date Updated'
+
+                    # Attempting to only update unload date
+                    else:
+                        cur.execute(load_date_query, [selected_request])
+                        lo_request = cur.fetchone()
+
+                        # There is no load date for this asset
+                        if lo_request is None or not lo_request[1]:
+                            message = 'The asset must be loaded before it can be unloaded.'
+
+                        # There is a load date for this asset-in-transit
+                        else:
+                            cur.execute(transit_unload_update, [unload_date, selected_request])
+                            cur.execute(new_asset_at, [record[1], record[3], unload_date])
+                            cur.execute(update_request, [selected_request])
+                            message = 'Unload Date Updated! Transfer Completed - Request Completed'
+            except helpers.TransactionFailed:
+                message = 'The transfer could not be updated. No changes were saved.'
+
+            if message:
+                flash(message)
 
             # Populate Table
             requests_query = ("SELECT r.request_pk, a.asset_tag, r.user_fk, "
@@ -145,39 +127,72 @@ def dashboard():
 
         # FACILITY OFFICER
         elif session['perms'] == 3:
-            selected_request = request.form.get('request_pk', None)
+            selected_requests = request.form.getlist('request_pk')
 
             # Nothing Selected
-            if not selected_request:
+            if not selected_requests:
                 flash('Please select a request.')
 
             # No requests in DB
-            elif selected_request == 'NO REQUESTS':
+            elif 'NO REQUESTS' in selected_requests:
                 flash('There are no requests to approve/disapprove.')
 
-            # Something selected
+            # Something selected: every selected request is handled in one transaction
             else:
-                # Request rejected (Marked as completed)
-                if 'reject' in request.form:
-                    reject_request = "UPDATE requests SET completed = TRUE WHERE request_pk = %s;"
-                    helpers.db_change(reject_request, [selected_request])
-                    flash('Request DENIED.')
-
-                # Request Approved
-                else:
-                    update_request_sql = ("UPDATE requests SET "
-                                          "approved = TRUE, "
-                                          "approving_user_fk = %s, "
-                                          "approve_dt = %s "
-                                          "WHERE request_pk = %s;")
-                    helpers.db_change(update_request_sql, [
-                            session['user_id'], datetime.datetime.now(), selected_request]
-                    )
-
-                    transit_sql = "INSERT INTO in_transit (request_fk) VALUES (%s);"
-                    helpers.db_change(transit_sql, [selected_request])
-
-                    flash('Request APPROVED.')
+                try:
+                    request_pks = [int(request_pk) for request_pk in selected_requests]
+                except ValueError:
+                    request_pks = []
+                    flash('Please select a request.')
+
+                # Only requests still awaiting approval are touched, so a request another
+                # officer has just handled is skipped rather than handled twice
+                reject_requests = ("UPDATE requests SET completed = TRUE "
+                                   "WHERE request_pk = ANY(%s) "
+                                   "AND approved = FALSE AND completed = FALSE;")
+                approve_requests = ("WITH approved AS ("
+                                    "UPDATE requests SET "
+                                    "approved = TRUE, "
+                                    "approving_user_fk = %s, "
+                                    "approve_dt = %s "
+                                    "WHERE request_pk = ANY(%s) "
+                                    "AND approved = FALSE AND completed = FALSE "
+                                    "RETURNING request_pk"
+                                    ") INSERT INTO in_transit (request_fk) "
+                                    "SELECT request_pk FROM approved "
+                                    "ON CONFLICT (request_fk) DO UPDATE SET "
+                                    "load_dt = EXCLUDED.load_dt, "
+                                    "unload_dt = EXCLUDED.unload_dt;")
+                rejecting = 'reject' in request.form
+
+                if request_pks:
+                    try:
+                        with helpers.transaction() as cur:
+                            # Request rejected (Marked as completed)
+                            if rejecting:
+                                cur.execute(reject_requests, [request_pks])
+
+                            # Request Approved
+                            else:
+                                cur.execute(approve_requests, [
+                                    session['user_id'], datetime.datetime.now(), request_pks
+                                ])
+                            handled = cur.rowcount
+
+                        outcome = 'DENIED' if rejecting else 'APPROVED'
+                        if len(request_pks) == 1 and handled == 1:
+                            flash('Request {}.'.format(outcome))
+                        else:
+                            flash('{} of {} requests {}.'.format(
+                                handled, len(request_pks), outcome
+                            ))
+                        if handled < len(request_pks):
+                            flash('{} of the selected requests had already been approved or '
+                                  'denied.'.format(len(request_pks) - handled))
+                    except helpers.TransactionFailed:
+                        flash('The requests could not be {}. No changes were saved.'.format(
+                            'denied' if rejecting else 'approved'
+                        ))
 
             # Populate Table
             requests_query = ("SELECT r.request_pk, a.asset_tag, r.user_fk, "
@@ -3,6 +3,61 @@ from flask import session, flash, render_template, request
 from app import app, helpers
 
 
+# Current assets table, one page at a time seeking on (asset_tag, asset_pk)
+all_assets_query = ("SELECT assets.asset_tag, assets.description, "
+                    "facilities.location, assets.disposed, "
+                    "assets.asset_tag, assets.asset_pk "
+                    "FROM assets JOIN asset_current ON assets.asset_pk = asset_current.asset_fk "
+                    "JOIN facilities ON asset_current.facility_fk = facilities.facility_pk "
+                    "WHERE {keyset} {order};")
+asset_keys = ['assets.asset_tag', 'assets.asset_pk']
+
+
+def _assets_page():
+    """Returns the page of the assets table picked by the request's after/before cursors."""
+    try:
+        return helpers.keyset_page(all_assets_query, [], asset_keys,
+                                   after=request.args.get('after'),
+                                   before=request.args.get('before'))
+    except ValueError:
+        flash('That page of assets could not be found. Showing the first page.')
+        return helpers.keyset_page(all_assets_query, [], asset_keys)
+
+
+# Bulk disposal: every tag is resolved by one query and every match disposed together
+resolve_tags = ("SELECT asset_tag, asset_pk, disposed FROM assets "
+                "WHERE asset_tag = ANY(%s) FOR UPDATE;")
+# An asset in transit already left its current stay when it was loaded; that date stands
+end_current_stays = ("UPDATE asset_at SET depart_dt = %s "
+                     "FROM asset_current as c "
+                     "WHERE c.asset_fk = ANY(%s) "
+                     "AND asset_at.asset_fk = c.asset_fk AND asset_at.arrive_dt = c.arrive_dt "
+                     "AND asset_at.depart_dt IS NULL;")
+dispose_assets_sql = "UPDATE assets SET disposed = TRUE WHERE asset_pk = ANY(%s);"
+
+
+def dispose_assets(tags, disposal_date):
+    """Disposes of every asset with one of tags in one transaction.
+
+    Returns (tags disposed, [(asset_tag, reason) for each tag that was not]).
+    """
+    with helpers.transaction() as cur:
+        cur.execute(resolve_tags, [tags])
+        matches = cur.fetchall()
+        disposable = [asset_pk for _, asset_pk, disposed in matches if not disposed]
+        if disposable:
+            cur.execute(end_current_stays, [disposal_date, disposable])
+            cur.execute(dispose_assets_sql, [disposable])
+
+    disposed = set(asset_tag for asset_tag, _, was_disposed in matches if not was_disposed)
+    found = set(asset_tag for asset_tag, _, _ in matches)
+    not_disposed = [(asset_tag, 'There does not exist an asset with that tag')
+                    for asset_tag in tags if asset_tag not in found]
+    not_disposed += [(asset_tag, 'Already disposed') for asset_tag in tags
+                     if asset_tag in found and asset_tag not in disposed]
+    return [tag for tag in tags if tag in disposed], not_disposed
+
+
 # TODO: Implement functionality for asset being set to disposed if moved from original facility
 @app.route('/dispose_asset', methods=['GET', 'POST'])
 def dispose_asset():
@@ -11,21 +66,47 @@ def dispose_asset():
         flash('You are not a Logistics Officer. You do not have permissions to remove assets!')
         return render_template('dashboard.html')
 
-    # Get all current assets for table population
+    # Get a page of current assets for table population
     else:
-        all_assets_query = ("SELECT assets.asset_tag, assets.description, "
-                            "facilities.location, assets.disposed "
-                            "FROM assets JOIN asset_at ON assets.asset_pk = asset_at.asset_fk "
-                            "JOIN facilities ON asset_at.facility_fk = facilities.facility_pk;")
-        all_assets = helpers.db_query(all_assets_query, [])
+        page = _assets_page()
+        all_assets = page['rows']
 
         # Handle table when no assets in database
-        if all_assets is None:
+        if not all_assets:
             all_assets = [(
                 'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES'
             )]
             flash('There are currently no assets to remove')
-            return render_template('dispose_asset.html', assets_list=all_assets)
+            return render_template('dispose_asset.html', assets_list=all_assets, page=page)
+
+        # Bulk disposal of a pasted or uploaded tag list
+        if request.method == 'POST' and request.form.get('mode') == 'bulk':
+            not_disposed = None
+            try:
+                tags = helpers.read_tag_list()
+            except ValueError as e:
+                tags = None
+                flash(str(e))
+            try:
+                validated_date = helpers.validate_date(request.form.get('date', ''))
+            except ValueError:
+                validated_date = None
+
+            if tags is not None and not tags:
+                flash('Please enter or upload at least one asset tag')
+            elif tags and validated_date is None:
+                flash('Please enter the date in the following format: MM/DD/YYYY')
+            elif tags:
+                try:
+                    disposed, not_disposed = dispose_assets(tags, validated_date)
+                    flash('{} of {} assets removed!'.format(len(disposed), len(tags)))
+                except helpers.TransactionFailed:
+                    flash('The assets could not be disposed. No changes were saved.')
+
+            page = _assets_page()
+            all_assets = page['rows'] or all_assets
+            return render_template('dispose_asset.html', assets_list=all_assets, page=page,
+                                   not_disposed=not_disposed)
 
         if request.method == 'POST':
             asset_tag = request.form.get('asset_tag', None).strip()
@@ -34,44 +115,59 @@ def dispose_asset():
             # If something is missing from the form...
             if not asset_tag or not date:
                 flash('Please complete the form')
-                return render_template('dispose_asset.html', assets_list=all_assets)
+                return render_template('dispose_asset.html', assets_list=all_assets, page=page)
             else:
                 try:
                     validated_date = helpers.validate_date(date)
                 except ValueError or TypeError or UnboundLocalError:
                     flash('Please enter the date in the following format: MM/DD/YYYY')
-                    return render_template('dispose_asset.html', assets_list=all_assets)
+                    return render_template('dispose_asset.html', assets_list=all_assets, page=page)
 
                 # Check for matching tag...
                 matching_asset = "SELECT asset_pk FROM assets WHERE asset_tag = %s;"
                 asset_does_exist = helpers.duplicate_check(matching_asset, [asset_tag])
 
                 if asset_does_exist:
-                    # Get asset_fk for asset_at update (returns a tuple in an array)
-                    asset_fk = helpers.db_query(matching_asset, [asset_tag])[0][0]
-
-                    # Change asset_at table to reflect impending disposal
-                    update_asset_at = "UPDATE asset_at SET depart_dt=%s WHERE asset_fk=%s;"
-                    helpers.db_change(update_asset_at, [validated_date, asset_fk])
-
-                    # Remove asset from assets
+                    # Only the current stay ends, and only if the asset has not been loaded
+                    # out of it; earlier stays keep their departure dates
+                    update_asset_at = ("UPDATE asset_at SET depart_dt=%s "
+                                       "FROM asset_current as c "
+                                       "WHERE asset_at.asset_fk=%s "
+                                       "AND c.asset_fk = asset_at.asset_fk "
+                                       "AND asset_at.arrive_dt = c.arrive_dt "
+                                       "AND asset_at.depart_dt IS NULL;")
                     asset_to_dispose = "UPDATE assets SET disposed=TRUE WHERE asset_tag = %s;"
-                    helpers.db_change(asset_to_dispose, [asset_tag])
+                    try:
+                        with helpers.transaction() as cur:
+                            # Get asset_fk for asset_at update
+                            cur.execute(matching_asset, [asset_tag])
+                            asset_fk = cur.fetchone()[0]
+
+                            # Change asset_at table to reflect impending disposal
+                            cur.execute(update_asset_at, [validated_date, asset_fk])
+
+                            # Remove asset from assets
+                            cur.execute(asset_to_dispose, [asset_tag])
+                    except helpers.TransactionFailed:
+                        flash('The asset could not be disposed. No changes were saved.')
+                        return render_template('dispose_asset.html', assets_list=all_assets,
+                                               page=page)
 
                     # Update current assets for view's table ('disposed' column will have changed)
-                    all_assets = helpers.db_query(all_assets_query, [])
+                    page = _assets_page()
+                    all_assets = page['rows']
 
                     # Handle table when no assets in database
-                    if all_assets is None:
+                    if not all_assets:
                         all_assets = [(
                             'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES', 'NO ENTRIES'
                         )]
 
                     flash('Asset removed!')
-                    return render_template('dispose_asset.html', assets_list=all_assets)
+                    return render_template('dispose_asset.html', assets_list=all_assets, page=page)
 
                 else:
                     flash('There does not exist an asset with that tag!')
-                    return render_template('dispose_asset.html', assets_list=all_assets)
+                    return render_template('dispose_asset.html', assets_list=all_assets, page=page)
 
-        return render_template('dispose_asset.html', assets_list=all_assets)
+        return render_template('dispose_asset.html', assets_list=all_assets, page=page)
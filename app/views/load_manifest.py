@@ -0,0 +1,166 @@
+from flask import session, request, flash, render_template
+from psycopg2.extras import execute_values
+
+from app import app, helpers
+
+
+MANIFEST_COLUMNS = ['request_pk', 'load_dt', 'unload_dt']
+
+# The state of every request named in the manifest, locked until the batch commits
+requests_query = ("SELECT r.request_pk, r.asset_fk, r.approved, r.completed, t.load_dt "
+                  "FROM requests as r "
+                  "LEFT JOIN in_transit as t ON r.request_pk = t.request_fk "
+                  "WHERE r.request_pk = ANY(%s) "
+                  "FOR UPDATE OF r;")
+stage_manifest = ("CREATE TEMP TABLE manifest ("
+                  "request_pk INTEGER PRIMARY KEY, load_dt TIMESTAMP, unload_dt TIMESTAMP"
+                  ") ON COMMIT DROP;")
+insert_manifest = "INSERT INTO manifest (request_pk, load_dt, unload_dt) VALUES %s;"
+
+# The same updates the dashboard makes for one request, for every accepted row at once
+transit_update = ("UPDATE in_transit as t SET "
+                  "load_dt = COALESCE(m.load_dt, t.load_dt), "
+                  "unload_dt = COALESCE(m.unload_dt, t.unload_dt) "
+                  "FROM manifest as m WHERE t.request_fk = m.request_pk;")
+update_asset_at = ("UPDATE asset_at as a_a SET depart_dt = m.load_dt "
+                   "FROM manifest as m "
+                   "JOIN requests as r ON r.request_pk = m.request_pk "
+                   "JOIN asset_current as c ON c.asset_fk = r.asset_fk "
+                   "WHERE m.load_dt IS NOT NULL "
+                   "AND a_a.asset_fk = c.asset_fk AND a_a.arrive_dt = c.arrive_dt;")
+new_asset_at = ("INSERT INTO asset_at (asset_fk, facility_fk, arrive_dt) "
+                "SELECT r.asset_fk, r.dest_fk, m.unload_dt "
+                "FROM manifest as m JOIN requests as r ON r.request_pk = m.request_pk "
+                "WHERE m.unload_dt IS NOT NULL;")
+update_requests = ("UPDATE requests as r SET completed = TRUE "
+                   "FROM manifest as m "
+                   "WHERE r.request_pk = m.request_pk AND m.unload_dt IS NOT NULL;")
+
+
+def _parse_row(row):
+    """Returns (request_pk, load_dt, unload_dt) for a manifest row, or an error string."""
+    try:
+        request_pk = int(row['request_pk'])
+    except ValueError:
+        return 'Error: Invalid Request'
+    try:
+        load_dt = helpers.validate_timestamp(row['load_dt']) if row['load_dt'] else None
+        unload_dt = helpers.validate_timestamp(row['unload_dt']) if row['unload_dt'] else None
+    except ValueError:
+        return 'Error: Invalid Date'
+
+    if not load_dt and not unload_dt:
+        return 'Error: No Load Or Unload Date'
+    if load_dt and unload_dt and load_dt > unload_dt:
+        return 'Error: Loaded After Unloaded'
+    return request_pk, load_dt, unload_dt
+
+
+def _row_error(parsed, state, assets_seen):
+    """Returns why a parsed row cannot be applied to its request's state, or None."""
+    request_pk, load_dt, unload_dt = parsed
+    if state is None or not state['approved']:
+        return 'Error: Request Not Approved'
+    if state['completed']:
+        return 'Error: Request Already Completed'
+    if state['asset_fk'] in assets_seen:
+        return 'Error: Asset Already In Manifest'
+    if not load_dt and not state['load_dt']:
+        return 'Error: Not Yet Loaded'
+    if not load_dt and unload_dt < state['load_dt']:
+        return 'Error: Loaded After Unloaded'
+    return None
+
+
+def apply_manifest(rows):
+    """Validates a whole manifest and applies its good rows in one transaction.
+
+    Returns a result per row. Bad rows are reported and skipped; if the transaction fails,
+    no row is applied.
+    """
+    results = [dict(row, row=number, result=None) for number, row in enumerate(rows, 1)]
+    parsed, requests_seen = {}, set()
+    for result in results:
+        outcome = _parse_row(result)
+        if isinstance(outcome, str):
+            result['result'] = outcome
+        elif outcome[0] in requests_seen:
+            result['result'] = 'Error: Duplicate Request In Manifest'
+        else:
+            parsed[result['row']] = outcome
+            requests_seen.add(outcome[0])
+
+    if not parsed:
+        return results
+
+    try:
+        with helpers.transaction() as cur:
+            cur.execute(requests_query, [list(requests_seen)])
+            states = dict((row[0], {'asset_fk': row[1], 'approved': row[2],
+                                    'completed': row[3], 'load_dt': row[4]})
+                          for row in cur.fetchall())
+
+            accepted, assets_seen = [], set()
+            for result in results:
+                if result['row'] not in parsed:
+                    continue
+                state = states.get(parsed[result['row']][0])
+                result['result'] = _row_error(parsed[result['row']], state, assets_seen)
+                if result['result'] is None:
+                    assets_seen.add(state['asset_fk'])
+                    accepted.append((result, parsed[result['row']]))
+
+            if accepted:
+                cur.execute(stage_manifest)
+                execute_values(cur, insert_manifest, [values for _, values in accepted],
+                               page_size=1000)
+                cur.execute(transit_update)
+                cur.execute(update_asset_at)  # Before new stays change the current ones
+                cur.execute(new_asset_at)
+                cur.execute(update_requests)
+    except helpers.TransactionFailed:
+        for result in results:
+            if result['row'] in parsed:
+                result['result'] = 'Error: Manifest Rolled Back'
+        return results
+
+    for result, (request_pk, load_dt, unload_dt) in accepted:
+        if load_dt and unload_dt:
+            result['result'] = 'Loaded And Unloaded - Request Completed'
+        elif load_dt:
+            result['result'] = 'Loaded'
+        else:
+            result['result'] = 'Unloaded - Request Completed'
+    return results
+
+
+@app.route('/load_manifest', methods=['GET', 'POST'])
+def load_manifest():
+    # Not a logistics officer...
+    if session.get('perms') != 2:
+        flash('You are not a Logistics Officer. You do not have permissions to load or unload '
+              'assets!')
+        return render_template('dashboard.html')
+
+    results = None
+    if request.method == 'POST':
+        upload = request.files.get('manifest')
+
+        # Form Completion Validation
+        if upload is None or not upload.filename:
+            flash('Please choose a manifest file to upload.')
+        else:
+            try:
+                rows = helpers.read_csv_upload(upload, MANIFEST_COLUMNS)
+            except ValueError as e:
+                rows = None
+                flash(str(e))
+
+            if rows is not None and not rows:
+                flash('That manifest has no rows.')
+            elif rows:
+                results = apply_manifest(rows)
+                applied = sum(not result['result'].startswith('Error') for result in results)
+                flash('{} of {} manifest rows applied.'.format(applied, len(results)))
+
+    return render_template('load_manifest.html', results=results, columns=MANIFEST_COLUMNS)
@@ -19,29 +19,37 @@ def login():
             flash('Please enter a password.')
             return render_template('login.html')
 
-        # Login form is not blank.
-        check_for_user = "SELECT * FROM users WHERE username = %s;"
-        result = helpers.db_query(check_for_user, [username])
+        # Login form is not blank. One query fetches everything the login needs.
+        user = helpers.fetch_user(username)
 
         # User does not exist.
-        if result is None:
+        if user is None:
             flash('There is no record of this account.')
             return render_template('login.html')
 
         # User is deactivated.
-        if not result[0][4]:
+        if not user[2]:
             flash('This account has been deactivated')
             return render_template('login.html')
 
-        # User exists:
-        authorized = helpers.authorize(username, password)
+        # User exists: the bcrypt check runs on the shared auth pool
+        try:
+            authorized = helpers.check_password(password, user[3])
+        except helpers.AuthServiceBusy:
+            flash('Too many people are signing in right now. Please try again in a moment.')
+            return render_template('login.html'), 503, {
+                'Retry-After': str(app.config['AUTH_RETRY_AFTER'])
+            }
 
         # Password is correct
         if authorized:
+            # Hashes made before BCRYPT_ROUNDS was raised are upgraded now we know the password
+            if helpers.needs_rehash(user[3]):
+                helpers.rehash_later(user[0], password, user[3])
             session['username'] = username
             session['logged_in'] = True
-            session['perms'] = result[0][1]
-            session['user_id'] = result[0][0]
+            session['perms'] = user[1]
+            session['user_id'] = user[0]
             return redirect('/dashboard')
 
         # Password is incorrect
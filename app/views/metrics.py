@@ -0,0 +1,36 @@
+from flask import request, g, Response
+import time
+
+from app import app, metrics
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.REQUEST_SECONDS.labels(
+            request.endpoint or 'unmatched', request.method, str(response.status_code)
+        ).observe(time.perf_counter() - started)
+    return response
+
+
+@app.teardown_request
+def record_failed_request_latency(error):
+    # after_request is skipped when a view raises and nothing handles it, so count those
+    # as 500s here; a request after_request already recorded has no start time left
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.REQUEST_SECONDS.labels(
+            request.endpoint or 'unmatched', request.method, '500'
+        ).observe(time.perf_counter() - started)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    body, content_type = metrics.latest()
+    return Response(body, content_type=content_type)
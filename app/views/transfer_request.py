@@ -4,6 +4,87 @@ import datetime
 from app import app, helpers
 
 
+# Assets that may be requested: at a facility, not disposed, and without an open request.
+# The NOT EXISTS anti-join is served by requests_open_asset_fk_idx.
+eligible_assets_from = ("FROM assets as a "
+                        "JOIN asset_current as c ON a.asset_pk = c.asset_fk "
+                        "JOIN facilities as f ON c.facility_fk = f.facility_pk "
+                        "WHERE NOT c.in_transit AND a.disposed IS NOT TRUE "
+                        "AND NOT EXISTS (SELECT 1 FROM requests as r "
+                        "WHERE r.asset_fk = a.asset_pk AND r.completed = FALSE) ")
+eligible_assets_query = ("SELECT a.asset_pk, a.asset_tag, c.facility_fk "
+                         + eligible_assets_from + "{where} ORDER BY a.asset_tag, a.asset_pk;")
+
+# The asset dropdown, one page at a time seeking on (asset_tag, asset_pk)
+eligible_assets_page_query = ("SELECT a.asset_pk, a.asset_tag, f.common_name, "
+                              "a.asset_tag, a.asset_pk "
+                              + eligible_assets_from + "AND {keyset} {order};")
+eligible_asset_keys = ['a.asset_tag', 'a.asset_pk']
+
+any_asset_query = "SELECT 1 FROM assets LIMIT 1;"
+known_tags_query = "SELECT DISTINCT asset_tag FROM assets WHERE asset_tag = ANY(%s);"
+request_transfers = ("INSERT INTO requests "
+                     "(asset_fk, user_fk, src_fk, dest_fk, request_dt, approved, completed) "
+                     "SELECT asset_fk, %s, facility_fk, %s, %s, FALSE, FALSE "
+                     "FROM asset_current WHERE asset_fk = ANY(%s);")
+
+
+def _eligible_assets_page():
+    """Returns the page of requestable assets picked by the request's after/before cursors."""
+    try:
+        return helpers.keyset_page(eligible_assets_page_query, [], eligible_asset_keys,
+                                   after=request.args.get('after'),
+                                   before=request.args.get('before'))
+    except ValueError:
+        flash('That page of assets could not be found. Showing the first page.')
+        return helpers.keyset_page(eligible_assets_page_query, [], eligible_asset_keys)
+
+
+def request_bulk_transfer(tags, src_facility, dest_facility, user_id):
+    """Files a transfer request for every eligible asset in one transaction.
+
+    With tags, each asset with one of those tags is checked (and must be at src_facility,
+    if given); without, every eligible asset at src_facility is moved. Returns the number
+    of requests filed and [(asset_tag, reason) for each tag that was not requested].
+    """
+    if tags:
+        where = "AND a.asset_tag = ANY(%s)"
+        args = [tags]
+    else:
+        where = "AND c.facility_fk = %s"
+        args = [src_facility]
+
+    with helpers.transaction() as cur:
+        cur.execute(eligible_assets_query.format(where=where), args)
+        candidates = cur.fetchall()
+        eligible, not_requested = [], []
+
+        # Tags the eligibility query left out
+        missing = set(tags) - set(candidate[1] for candidate in candidates)
+        if missing:
+            cur.execute(known_tags_query, [list(missing)])
+            known = set(row[0] for row in cur.fetchall())
+            not_requested += [(asset_tag, 'Disposed, in transit or already requested')
+                              if asset_tag in known else
+                              (asset_tag, 'There does not exist an asset with that tag')
+                              for asset_tag in tags if asset_tag in missing]
+
+        for asset_pk, asset_tag, facility_fk in candidates:
+            if src_facility is not None and facility_fk != src_facility:
+                not_requested.append((asset_tag, 'Not at the source facility'))
+            elif facility_fk == dest_facility:
+                not_requested.append((asset_tag, 'Already at the destination facility'))
+            else:
+                eligible.append(asset_pk)
+
+        if eligible:
+            cur.execute(request_transfers, [
+                user_id, dest_facility, datetime.datetime.now(), eligible
+            ])
+
+    return len(eligible), not_requested
+
+
 @app.route('/transfer_req', methods=['GET', 'POST'])
 def transfer_req():
     # Not a logistics officer...
@@ -12,11 +93,48 @@ def transfer_req():
         return render_template('dashboard.html')
 
     request_is_post = False
-    if request.method == 'POST':
+    not_requested = None
+    if request.method == 'POST' and request.form.get('mode') == 'bulk':
+        request_is_post = True
+        try:
+            tags, tags_error = helpers.read_tag_list(), None
+        except ValueError as e:
+            tags, tags_error = [], str(e)
+        try:
+            src_facility = int(request.form.get('src_facility') or 0) or None
+            dest_facility = int(request.form.get('dest_facility') or 0) or None
+        except ValueError:
+            src_facility, dest_facility = None, None
+        every_asset_at_source = 'all_at_source' in request.form
+
+        # Form Completion Validation
+        if tags_error:
+            flash(tags_error)
+        elif not dest_facility:
+            flash('Please select a destination facility.')
+        elif every_asset_at_source and not src_facility:
+            flash('Please select the source facility to move every asset from.')
+        elif not every_asset_at_source and not tags:
+            flash('Please enter or upload at least one asset tag.')
+        elif src_facility == dest_facility:
+            flash('Please select different facilities in order to submit a transfer request.')
+        else:
+            try:
+                requested, not_requested = request_bulk_transfer(
+                    [] if every_asset_at_source else tags, src_facility, dest_facility,
+                    session['user_id']
+                )
+                flash('{} Requests Submitted. Please await Facility Officer approval.'.format(
+                    requested
+                ))
+            except helpers.TransactionFailed:
+                flash('The transfer requests could not be submitted. No changes were saved.')
+
+    elif request.method == 'POST':
         request_is_post = True
-        asset_key = request.form['asset']
-        src_facility = request.form['src_facility']
-        dest_facility = request.form['dest_facility']
+        asset_key = request.form.get('asset', '')
+        src_facility = request.form.get('src_facility', '')
+        dest_facility = request.form.get('dest_facility', '')
 
         # Form Completion Validation
         if asset_key == '':
@@ -26,60 +144,64 @@ def transfer_req():
             flash('Please select a facility.')
             return redirect(url_for('transfer_req'))
 
-        location_query = ("SELECT asset_at.facility_fk FROM asset_at "
-                          "JOIN assets ON asset_at.asset_fk = assets.asset_pk "
-                          "WHERE asset_pk = %s;")
-        actual_asset_location = helpers.db_query(location_query, [asset_key])
-
-        if actual_asset_location is None:
-            flash('There is either no facilities or assets in the database.')
-            return redirect(url_for('dashboard'))
-
-        if src_facility != str(actual_asset_location[0][0]):
-            flash('The source facility you selected is not where the asset is stored.')
-            return redirect(url_for('transfer_req'))
-        elif dest_facility == src_facility:
-            flash('Please select different facilities in order to submit a transfer request.')
-            return redirect(url_for('transfer_req'))
-
-        # Inputs Validated
-        else:
-            request_sql = ("INSERT INTO requests "
-                           "(asset_fk, user_fk, src_fk, dest_fk, request_dt, approved, completed) "
-                           "VALUES "
-                           "(%s, %s, %s, %s, %s, 'False', 'False');")
-
-            helpers.db_change(
-                request_sql, [
-                    asset_key,
-                    session['user_id'],
-                    src_facility,
-                    dest_facility,
-                    datetime.datetime.now()
-                ]
-            )
-
+        location_query = ("SELECT facility_fk, in_transit FROM asset_current "
+                          "WHERE asset_fk = %s;")
+        request_sql = ("INSERT INTO requests "
+                       "(asset_fk, user_fk, src_fk, dest_fk, request_dt, approved, completed) "
+                       "VALUES "
+                       "(%s, %s, %s, %s, %s, 'False', 'False');")
+
+        # Validate the asset's location and file the request in one transaction
+        try:
+            with helpers.transaction() as cur:
+                cur.execute(location_query, [asset_key])
+                actual_asset_location = cur.fetchall()
+
+                if not actual_asset_location:
+                    flash('There is either no facilities or assets in the database.')
+                    return redirect(url_for('dashboard'))
+
+                if actual_asset_location[0][1]:
+                    flash('That asset is in transit. It can be moved again once it is unloaded.')
+                    return redirect(url_for('transfer_req'))
+                elif src_facility != str(actual_asset_location[0][0]):
+                    flash('The source facility you selected is not where the asset is stored.')
+                    return redirect(url_for('transfer_req'))
+                elif dest_facility == src_facility:
+                    flash('Please select different facilities in order to submit a transfer request.')
+                    return redirect(url_for('transfer_req'))
+
+                # Inputs Validated
+                cur.execute(
+                    request_sql, [
+                        asset_key,
+                        session['user_id'],
+                        src_facility,
+                        dest_facility,
+                        datetime.datetime.now()
+                    ]
+                )
             flash('Request Submitted. Please await Facility Officer approval.')
+        except helpers.TransactionFailed:
+            flash('The transfer request could not be submitted. No changes were saved.')
 
     # Query relevant data for dropdown selections
     # Facilities
-    all_facilities_query = "SELECT * FROM facilities;"
-    all_facilities = helpers.db_query(all_facilities_query, [])
+    all_facilities = helpers.get_facilities()
 
     if all_facilities is None:
         flash('You must add facilities to the database before you can create transfer requests.')
         return redirect(url_for('dashboard'))
 
-    # Assets
-    all_assets_query = ("SELECT * FROM assets WHERE asset_pk NOT IN "
-                        "(SELECT asset_fk FROM requests "
-                        "WHERE completed='FALSE' AND approved='FALSE')"
-                        ";")
-    all_assets = helpers.db_query(all_assets_query, [])
+    # Assets, one page of the dropdown at a time
+    page = _eligible_assets_page()
 
-    # Handle empty result query cases
-    if request_is_post and all_assets is None:
+    # Handle empty result query cases. An empty page only means there are no assets at all
+    # if none exist, and a bulk submission's outcome is always shown.
+    if (request_is_post and not page['rows'] and not_requested is None
+            and not helpers.db_query(any_asset_query, [])):
         flash('You must add assets to the database before you can create transfer requests.')
         return redirect(url_for('dashboard'))
 
-    return render_template('transfer_req.html', asset_list=all_assets, facility_list=all_facilities)
+    return render_template('transfer_req.html', asset_list=page['rows'], page=page,
+                           facility_list=all_facilities, not_requested=not_requested)
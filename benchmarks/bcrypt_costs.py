@@ -0,0 +1,40 @@
+import sys
+import time
+import bcrypt
+
+
+# Usage: bcrypt_costs.py [--costs=<first>-<last>] [--runs=<verifies per cost>]
+# Reports how long one password verification takes at each bcrypt work factor, to pick
+# BCRYPT_ROUNDS in config.py. Each step up doubles the cost of every login.
+OPTIONS = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+FIRST_COST, _, LAST_COST = (OPTIONS.get('costs') or '10-16').partition('-')
+FIRST_COST = int(FIRST_COST)
+LAST_COST = int(LAST_COST or FIRST_COST)
+RUNS = int(OPTIONS.get('runs') or 5)
+PASSWORD = b'correct horse battery staple'
+
+
+def time_verify(cost):
+    """Return the (min, median, max) seconds to verify PASSWORD against a hash at cost."""
+    hashed = bcrypt.hashpw(PASSWORD, bcrypt.gensalt(cost))
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        bcrypt.checkpw(PASSWORD, hashed)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[0], timings[len(timings) // 2], timings[-1]
+
+
+def main():
+    print('cost   min (ms)   median (ms)   max (ms)   verifies/s per core')
+    for cost in range(FIRST_COST, LAST_COST + 1):
+        fastest, median, slowest = time_verify(cost)
+        print('{:>4} {:>10.1f} {:>13.1f} {:>10.1f} {:>21.1f}'.format(
+            cost, fastest * 1000, median * 1000, slowest * 1000, 1 / median
+        ))
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import csv
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+
+# Usage: generate_data.py <output dir> [--assets=<count>] [--depth=<moves per asset>]
+#                         [--facilities=<count>] [--users=<count>] [--seed=<n>]
+# Writes users.csv, facilities.csv, assets.csv and transfers.csv in the format
+# imports/import.py reads, plus manifest.json describing the scale. Each asset starts at
+# a random facility and then moves up to --depth times; the last move of some assets is
+# still awaiting approval or in transit, and some assets end up disposed.
+ARGS = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+OPTIONS = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+if len(ARGS) > 0:
+    OUT_DIR = ARGS[0]
+else:
+    OUT_DIR = 'bench_data'
+ASSETS = int(OPTIONS.get('assets') or 10000)
+DEPTH = int(OPTIONS.get('depth') or 5)
+FACILITIES = int(OPTIONS.get('facilities') or 50)
+USERS = int(OPTIONS.get('users') or 100)
+SEED = int(OPTIONS.get('seed') or 1)
+
+START = datetime.date(2000, 1, 1)
+PENDING_SHARE = 0.01  # Assets whose last request is awaiting approval
+IN_TRANSIT_SHARE = 0.01  # Assets whose last request is approved but not yet unloaded
+DISPOSED_SHARE = 0.05
+DESCRIPTIONS = ['Stargate', 'Naquadah generator', 'Zat gun', 'Staff weapon', 'Puddle jumper',
+                'Healing device', 'Ancient tablet', 'Kull armor', 'Transport rings', 'DHD']
+
+
+def user_name(n):
+    return 'user%d' % n
+
+
+def user_password(n):
+    """Passwords are predictable so benchmarks/run.py can log in as any generated user."""
+    return 'pass%d' % n
+
+
+def write_users(writer):
+    writer.writerow(['username', 'password', 'role', 'active'])
+    for n in range(1, USERS + 1):
+        role = 'Logistics Officer' if n % 2 else 'Facilities Officer'
+        writer.writerow([user_name(n), user_password(n), role, 'True'])
+
+
+def write_facilities(writer):
+    writer.writerow(['fcode', 'common_name', 'location'])
+    for n in range(1, FACILITIES + 1):
+        writer.writerow(['F%04d' % n, 'Facility %d' % n, 'Sector %d' % n])
+
+
+def write_assets_and_transfers(asset_writer, transfer_writer, rng):
+    """Writes every asset with its movement history; returns the number of transfers."""
+    asset_writer.writerow(['asset_tag', 'description', 'facility', 'acquired', 'disposed'])
+    transfer_writer.writerow(['asset_tag', 'request_by', 'request_dt', 'approve_by',
+                              'approve_dt', 'source', 'destination', 'load_dt', 'unload_dt'])
+    logistics = [user_name(n) for n in range(1, USERS + 1, 2)]
+    facility_officers = [user_name(n) for n in range(2, USERS + 1, 2)] or logistics
+    transfers = 0
+
+    for n in range(1, ASSETS + 1):
+        tag = 'BX%07d' % n
+        origin = here = rng.randrange(1, FACILITIES + 1)
+        acquired = START + datetime.timedelta(days=rng.randrange(365))
+        day = acquired
+        moves = rng.randrange(DEPTH + 1)
+        last_state = rng.random()
+        open_request = moves and last_state < PENDING_SHARE + IN_TRANSIT_SHARE
+        disposed = ''
+
+        rows = []
+        for move in range(moves):
+            there = rng.randrange(1, FACILITIES) if FACILITIES > 1 else here
+            if there >= here:
+                there += 1
+            request_dt = day + datetime.timedelta(days=rng.randrange(20, 120))
+            approve_dt = request_dt + datetime.timedelta(days=rng.randrange(0, 3))
+            load_dt = approve_dt + datetime.timedelta(days=rng.randrange(0, 3))
+            unload_dt = load_dt + datetime.timedelta(days=rng.randrange(1, 5))
+            row = [tag, rng.choice(logistics), request_dt, rng.choice(facility_officers),
+                   approve_dt, 'F%04d' % here, 'F%04d' % there, load_dt, unload_dt]
+
+            if move == moves - 1 and open_request:
+                if last_state < PENDING_SHARE:
+                    row[3:5] = ['', '']  # Awaiting approval
+                    row[7:9] = ['', '']
+                else:
+                    row[8] = ''  # Loaded, not yet unloaded
+            else:
+                here, day = there, unload_dt
+            rows.append(row)
+
+        if not open_request and rng.random() < DISPOSED_SHARE:
+            disposed = day + datetime.timedelta(days=rng.randrange(30, 365))
+
+        description = '%s %d' % (DESCRIPTIONS[n % len(DESCRIPTIONS)], n)
+        asset_writer.writerow([tag, description, 'F%04d' % origin, acquired, disposed])
+        transfer_writer.writerows(rows)
+        transfers += len(rows)
+
+    return transfers
+
+
+def main():
+    if not os.path.isdir(OUT_DIR):
+        os.makedirs(OUT_DIR)
+    rng = random.Random(SEED)
+    started = time.time()
+
+    with open(os.path.join(OUT_DIR, 'users.csv'), 'w', newline='') as users_file:
+        write_users(csv.writer(users_file, quotechar="'"))
+    with open(os.path.join(OUT_DIR, 'facilities.csv'), 'w', newline='') as facilities_file:
+        write_facilities(csv.writer(facilities_file, quotechar="'"))
+    with open(os.path.join(OUT_DIR, 'assets.csv'), 'w', newline='') as assets_file, \
+            open(os.path.join(OUT_DIR, 'transfers.csv'), 'w', newline='') as transfers_file:
+        transfers = write_assets_and_transfers(csv.writer(assets_file, quotechar="'"),
+                                               csv.writer(transfers_file, quotechar="'"), rng)
+
+    manifest = {'assets': ASSETS, 'depth': DEPTH, 'facilities': FACILITIES, 'users': USERS,
+                'seed': SEED, 'transfers': transfers}
+    with open(os.path.join(OUT_DIR, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    print('Wrote', ASSETS, 'assets,', transfers, 'transfers,', FACILITIES, 'facilities and',
+          USERS, 'users to', OUT_DIR, 'in', round(time.time() - started, 1), 's')
+    return
+
+
+if __name__ == '__main__':
+    main()
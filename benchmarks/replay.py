@@ -0,0 +1,195 @@
+import collections
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+
+# Usage: replay.py <traffic.jsonl> [--target=<base url>] [--concurrency=<threads>]
+#                  [--speedup=<factor>] [--users=<role>=<username>:<password>,...]
+#                  [--output=<results file>]
+# Replays requests recorded with RECORD_TRAFFIC=1 and reports throughput and latency
+# percentiles per route. Without --target the app runs in-process through the Flask test
+# client (it uses DATABASE_URL like the app does); with one, requests go over HTTP to a
+# running server such as a local gunicorn. --speedup=2 replays twice as fast as recorded;
+# --speedup=0 sends every request as soon as a thread is free. Recorded POSTs are replayed
+# too, so point it at a scratch database. Recorded passwords are redacted, so replayed
+# logins fail, but they still cost one bcrypt check each like the originals did.
+ARGS = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+OPTIONS = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+if len(ARGS) < 1:
+    print('Usage: replay.py <traffic.jsonl> [--target=URL] [--concurrency=N] [--speedup=X] '
+          '[--users=2=user1:pass1,3=user2:pass2] [--output=<file>]')
+    sys.exit(1)
+TRAFFIC_FILE = ARGS[0]
+TARGET = OPTIONS.get('target')
+CONCURRENCY = int(OPTIONS.get('concurrency') or 8)
+SPEEDUP = float(OPTIONS.get('speedup') or 1)
+OUTPUT = OPTIONS.get('output')
+# generate_data.py users by default: user1 is a logistics officer, user2 a facility officer
+USERS = dict(
+    (int(role), tuple(credentials.split(':', 1)))
+    for role, _, credentials in (
+        user.partition('=') for user in (OPTIONS.get('users') or '2=user1:pass1,3=user2:pass2')
+        .split(',')
+    )
+)
+
+
+def load_traffic(filename):
+    """Return the recorded requests in the order they arrived."""
+    with open(filename) as traffic:
+        records = [json.loads(line) for line in traffic if line.strip()]
+    records.sort(key=lambda record: record['at'])
+    return records
+
+
+class InProcessClient(object):
+    """Sends requests to the app through the Flask test client."""
+
+    def __init__(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        if root not in sys.path:
+            sys.path.insert(0, root)
+        from app import app
+        self._client = app.test_client()
+
+    def send(self, method, path, args, form):
+        response = self._client.open(path, method=method, query_string=args, data=form)
+        response.get_data()
+        return response.status_code
+
+
+class HttpClient(object):
+    """Sends requests to a running server, keeping cookies between them."""
+
+    def __init__(self):
+        import requests
+        self._session = requests.Session()
+
+    def send(self, method, path, args, form):
+        response = self._session.request(method, TARGET.rstrip('/') + path, params=args,
+                                         data=form, allow_redirects=False)
+        return response.status_code
+
+
+def make_client(role):
+    """Return a client whose session is logged in with role, or anonymous for none."""
+    client = HttpClient() if TARGET else InProcessClient()
+    if role is not None:
+        if role not in USERS:
+            raise SystemExit('No --users entry for role %s' % role)
+        username, password = USERS[role]
+        status = client.send('POST', '/login', {}, {'username': username, 'password': password})
+        if status != 302:
+            raise SystemExit('Could not log in as %s (HTTP %s)' % (username, status))
+    return client
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def replay(records):
+    """Send records from CONCURRENCY threads on the recorded schedule; return the results."""
+    work = queue.Queue(maxsize=CONCURRENCY * 4)
+    results = []
+    results_lock = threading.Lock()
+
+    # Each thread gets its own session per role, logged in before the clock starts
+    roles = set(record.get('role') for record in records)
+    sessions = [dict((role, make_client(role)) for role in roles) for _ in range(CONCURRENCY)]
+
+    def worker(clients):
+        while True:
+            record = work.get()
+            if record is None:
+                return
+            started = time.perf_counter()
+            try:
+                status = clients[record.get('role')].send(
+                    record['method'], record['path'], record.get('args') or {},
+                    record.get('form') or {}
+                )
+            except Exception as e:
+                print('REQUEST FAILED', record['method'], record['path'], e)
+                status = None
+            elapsed = time.perf_counter() - started
+            with results_lock:
+                results.append((record['route'], elapsed, status))
+
+    threads = [threading.Thread(target=worker, args=(clients,), daemon=True)
+               for clients in sessions]
+    for thread in threads:
+        thread.start()
+
+    started = time.perf_counter()
+    first_at = records[0]['at'] if records else 0
+    for record in records:
+        if SPEEDUP > 0:
+            delay = (record['at'] - first_at) / SPEEDUP - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        work.put(record)
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    """Return per-route and overall request counts, throughput and latency percentiles."""
+    by_route = collections.defaultdict(list)
+    errors = collections.Counter()
+    for route, seconds, status in results:
+        for name in (route, 'ALL'):
+            by_route[name].append(seconds)
+            if status is None or status >= 500:
+                errors[name] += 1
+
+    summary = {}
+    for route, timings in by_route.items():
+        timings.sort()
+        summary[route] = {
+            'requests': len(timings),
+            'errors': errors[route],
+            'per_second': len(timings) / elapsed if elapsed > 0 else 0,
+            'p50': percentile(timings, 0.50),
+            'p95': percentile(timings, 0.95),
+            'p99': percentile(timings, 0.99),
+            'max': timings[-1],
+        }
+    return summary
+
+
+def main():
+    records = load_traffic(TRAFFIC_FILE)
+    print('Replaying', len(records), 'requests', 'to ' + TARGET if TARGET else 'in-process',
+          'with', CONCURRENCY, 'threads at', SPEEDUP or 'full', 'speed')
+    results, elapsed = replay(records)
+    summary = summarize(results, elapsed)
+
+    print('\n{:<28}{:>9}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+        'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for route in sorted(summary, key=lambda name: (name == 'ALL', name)):
+        row = summary[route]
+        print('{:<28}{:>9}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+            route, row['requests'], row['errors'], row['per_second'],
+            row['p50'] * 1000, row['p95'] * 1000, row['p99'] * 1000))
+
+    if OUTPUT:
+        with open(OUTPUT, 'w') as output_file:
+            json.dump({'traffic': TRAFFIC_FILE, 'target': TARGET or 'in-process',
+                       'concurrency': CONCURRENCY, 'speedup': SPEEDUP, 'seconds': elapsed,
+                       'routes': summary}, output_file, indent=2, sort_keys=True)
+        print('\nResults written to', OUTPUT)
+    return
+
+
+if __name__ == '__main__':
+    main()
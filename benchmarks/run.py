@@ -0,0 +1,214 @@
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import psycopg2
+
+
+# Usage: run.py <data dir> [<dbname>] [--runs=<requests per web benchmark>]
+#               [--logins=<logins per login benchmark>] [--rounds=<bcrypt cost>]
+#               [--output=<results file>]
+# Drops and recreates <dbname> (default lost_bench), imports a generate_data.py dataset
+# into it and times the import, both exports, the asset report variants, both dashboards
+# and logins. Results go to a JSON file named after the current commit, so runs on two
+# commits can be compared side by side.
+ARGS = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+OPTIONS = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+if len(ARGS) < 1:
+    print('Usage: run.py <data dir> [<dbname>] [--runs=N] [--logins=N] [--rounds=N] '
+          '[--output=<file>]')
+    sys.exit(1)
+DATA_DIR = os.path.abspath(ARGS[0])
+DB_NAME = ARGS[1] if len(ARGS) > 1 else 'lost_bench'
+RUNS = int(OPTIONS.get('runs') or 20)
+LOGINS = int(OPTIONS.get('logins') or 20)
+BCRYPT_ROUNDS = int(OPTIONS.get('rounds') or 12)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMIT = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                        stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+OUTPUT = OPTIONS.get('output') or os.path.join(ROOT, 'benchmarks', 'results',
+                                                (COMMIT or 'unknown') + '.json')
+if DB_NAME == 'lost':
+    print('Refusing to drop the application database; pick another name.')
+    sys.exit(1)
+
+
+def summarize(timings):
+    """Return the count, min, median, p95 and max of a list of seconds."""
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'max': timings[-1],
+    }
+
+
+def time_command(command, cwd):
+    """Run a command to completion and return how long it took."""
+    started = time.perf_counter()
+    subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def recreate_database():
+    conn = psycopg2.connect(dbname='postgres', host='localhost', port=5432)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute('DROP DATABASE IF EXISTS "' + DB_NAME + '";')
+    cur.execute('CREATE DATABASE "' + DB_NAME + '";')
+    conn.close()
+    sql_dir = os.path.join(ROOT, 'sql')
+    subprocess.run(['psql', '-q', '-h', 'localhost', DB_NAME, '-f', 'create_tables.sql'],
+                   cwd=sql_dir, check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([sys.executable, 'migrate.py', DB_NAME], cwd=sql_dir, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def benchmark_scripts(results):
+    """Time the bulk import and both export modes."""
+    seconds = time_command([sys.executable, 'import.py', DB_NAME, DATA_DIR, '--bulk',
+                            '--rounds=%d' % BCRYPT_ROUNDS], os.path.join(ROOT, 'imports'))
+    results['import_bulk'] = {'seconds': seconds}
+    print('import (bulk)', round(seconds, 2), 's')
+
+    conn = psycopg2.connect(dbname=DB_NAME, host='localhost', port=5432)
+    cur = conn.cursor()
+    for table in ('assets', 'asset_at', 'requests'):
+        cur.execute('ANALYZE ' + table + ';')
+    conn.commit()
+    conn.close()
+
+    script = os.path.join(ROOT, 'exports', 'migrations.py')
+    for name, extra in (('export_serial', []), ('export_parallel', ['--parallel'])):
+        with tempfile.TemporaryDirectory() as out_dir:
+            seconds = time_command([sys.executable, script, DB_NAME] + extra, out_dir)
+        results[name] = {'seconds': seconds}
+        print(name, round(seconds, 2), 's')
+
+
+def report_parameters():
+    """Return a date in the middle of the asset history and the busiest facility's pk."""
+    conn = psycopg2.connect(dbname=DB_NAME, host='localhost', port=5432)
+    cur = conn.cursor()
+    cur.execute("SELECT min(arrive_dt) + (max(arrive_dt) - min(arrive_dt)) / 2 FROM asset_at;")
+    date = cur.fetchone()[0]
+    cur.execute("SELECT facility_fk FROM asset_at GROUP BY facility_fk "
+                "ORDER BY COUNT(*) DESC LIMIT 1;")
+    facility = cur.fetchone()[0]
+    conn.close()
+    return date.strftime('%m/%d/%Y'), facility
+
+
+def timed_gets(client, url, runs):
+    """Return the seconds each of runs GETs of url took, reading the whole body."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        timings.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError('%s answered %s' % (url, response.status_code))
+    return timings
+
+
+def benchmark_app(results):
+    """Time the report, dashboard and login routes through the Flask test client."""
+    os.environ['DATABASE_URL'] = 'postgres://localhost/' + DB_NAME
+    os.environ['BCRYPT_ROUNDS'] = str(BCRYPT_ROUNDS)  # Or every login would start a rehash
+    os.environ.setdefault('SLOW_QUERY_LOG', os.path.join(tempfile.gettempdir(),
+                                                         'lost_bench_slow_queries.jsonl'))
+    sys.path.insert(0, ROOT)
+    from app import app, helpers
+
+    # generate_data.py: odd users are logistics officers, even ones facility officers
+    logistics, facilities = app.test_client(), app.test_client()
+    for client, n in ((logistics, 1), (facilities, 2)):
+        response = client.post('/login', data={'username': 'user%d' % n,
+                                               'password': 'pass%d' % n})
+        if response.status_code != 302:
+            raise RuntimeError('Could not log in as user%d' % n)
+
+    date, facility = report_parameters()
+    report = '/asset_report?date={}&facility={}'.format(date, '{}')
+    urls = [
+        ('asset_report_all_page', report.format('All')),
+        ('asset_report_facility_page', report.format(facility)),
+        ('asset_report_all_csv', report.format('All') + '&format=csv'),
+        ('asset_report_all_ndjson', report.format('All') + '&format=ndjson'),
+        ('asset_report_facility_csv', report.format(facility) + '&format=csv'),
+    ]
+    for name, url in urls:
+        results[name] = summarize(timed_gets(logistics, url, RUNS))
+        print(name, round(results[name]['median'] * 1000, 1), 'ms median')
+
+    results['dashboard_logistics'] = summarize(timed_gets(logistics, '/dashboard', RUNS))
+    results['dashboard_facilities'] = summarize(timed_gets(facilities, '/dashboard', RUNS))
+    print('dashboards', round(results['dashboard_logistics']['median'] * 1000, 1), 'ms /',
+          round(results['dashboard_facilities']['median'] * 1000, 1), 'ms median')
+
+    def login(n, timings):
+        started = time.perf_counter()
+        response = app.test_client().post('/login', data={'username': 'user%d' % n,
+                                                          'password': 'pass%d' % n})
+        timings.append((time.perf_counter() - started, response.status_code))
+
+    # One at a time, then as many at once as the auth pool admits
+    timings = []
+    for n in range(LOGINS):
+        login(1 + n % 2, timings)
+    results['login_serial'] = summarize([seconds for seconds, status in timings])
+    results['login_serial']['per_second'] = LOGINS / sum(seconds for seconds, _ in timings)
+
+    timings = []
+    threads = [threading.Thread(target=login, args=(1 + n % 2, timings))
+               for n in range(LOGINS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    results['login_concurrent'] = summarize([seconds for seconds, status in timings])
+    results['login_concurrent']['per_second'] = LOGINS / elapsed
+    results['login_concurrent']['rejected_busy'] = sum(status == 503 for _, status in timings)
+    print('logins', round(results['login_serial']['per_second'], 1), '/s serial,',
+          round(results['login_concurrent']['per_second'], 1), '/s concurrent')
+    results['pool'] = helpers.pool_stats()
+
+
+def main():
+    with open(os.path.join(DATA_DIR, 'manifest.json')) as manifest_file:
+        manifest = json.load(manifest_file)
+    results = {}
+    print('Benchmarking commit', COMMIT, 'against', DB_NAME, 'with', manifest)
+
+    recreate_database()
+    benchmark_scripts(results)
+    benchmark_app(results)
+
+    if not os.path.isdir(os.path.dirname(OUTPUT)):
+        os.makedirs(os.path.dirname(OUTPUT))
+    with open(OUTPUT, 'w') as output_file:
+        json.dump({
+            'commit': COMMIT,
+            'ran_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'database': DB_NAME,
+            'dataset': manifest,
+            'bcrypt_rounds': BCRYPT_ROUNDS,
+            'runs': RUNS,
+            'results': results,
+        }, output_file, indent=2, sort_keys=True)
+    print('\nResults written to', OUTPUT)
+    return
+
+
+if __name__ == '__main__':
+    main()
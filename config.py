@@ -11,4 +11,66 @@ if is_prod:
 # Local Development
 else:
     SECRET_KEY = 'this_little_pig_went_to_the_market'
-    SQLALCHEMY_DATABASE_URI = 'postgres://localhost/lost'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgres://localhost/lost')
+
+# Database connection pool (one pool per gunicorn worker process)
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # Seconds to wait for a free connection
+DB_POOL_MAX_USES = int(os.environ.get('DB_POOL_MAX_USES', 1000))  # Recycle after this many checkouts
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', 1800))  # Recycle after this many seconds
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', 30))  # Health check if idle this long
+
+# Rows per page in the paginated asset tables
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+
+# Request threads per gunicorn worker process (gunicorn_config.py passes this to gunicorn)
+THREADS = int(os.environ.get('THREADS', 4))
+
+# Password checks run on a small thread pool so a burst of logins cannot tie up every worker.
+# Each waiting check holds a request thread, so the queue depth must stay below THREADS or
+# logins fill every thread before the busy 503 is ever sent; the default leaves one free.
+AUTH_WORKERS = int(os.environ.get('AUTH_WORKERS', 2))
+AUTH_QUEUE_DEPTH = int(os.environ.get('AUTH_QUEUE_DEPTH', max(1, THREADS - 1)))  # Running or waiting
+AUTH_TIMEOUT = float(os.environ.get('AUTH_TIMEOUT', 10))  # Seconds a login waits for its check
+AUTH_RETRY_AFTER = int(os.environ.get('AUTH_RETRY_AFTER', 2))  # Retry-After sent with a busy 503
+
+# The /rest user API only answers requests that send this value in an X-API-Token header;
+# while it is unset the API is switched off
+API_TOKEN = os.environ.get('API_TOKEN')
+API_MAX_BATCH = int(os.environ.get('API_MAX_BATCH', 5000))  # Users per batch call
+
+# bcrypt work factor for new hashes; older, cheaper hashes are upgraded on the next good login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+# Rows fetched per round trip when a report is streamed as CSV or NDJSON
+STREAM_ITERSIZE = int(os.environ.get('STREAM_ITERSIZE', 2000))
+
+# Largest CSV upload (manifests, bulk asset files) Flask accepts; bigger ones get a 413
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_BYTES', 16 * 1024 * 1024))
+
+# Shared directory where each worker writes its Prometheus samples for /metrics to add up.
+# Empty it before the server starts (gunicorn_config.py does this).
+METRICS_DIR = os.environ.get('METRICS_DIR', '/tmp/lost_metrics')
+
+# Statements slower than this are written to the slow-query log, a sample of them with a plan
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0.5))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0.1))  # 0 to 1
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', 'slow_queries.jsonl')
+SLOW_QUERY_LOG_BYTES = int(os.environ.get('SLOW_QUERY_LOG_BYTES', 10 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 5))
+
+# Request profiler. The rate and mode can be changed while running by writing
+# {"rate": 0.05, "mode": "cprofile"} to PROFILE_CONTROL; delete the file to go back to these.
+PROFILE_RATE = float(os.environ.get('PROFILE_RATE', 0))  # Fraction of requests profiled
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'sample')  # 'sample' (collapsed stacks) or 'cprofile'
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))  # Seconds between samples
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')  # X-Profile-Token value that forces a profile
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_CONTROL = os.environ.get('PROFILE_CONTROL', 'profile_control.json')
+
+# Traffic recorder: appends one sanitised JSON line per request for benchmarks/replay.py
+RECORD_TRAFFIC = os.environ.get('RECORD_TRAFFIC', '') not in ('', '0', 'false', 'False')
+TRAFFIC_LOG = os.environ.get('TRAFFIC_LOG', 'traffic.jsonl')
+TRAFFIC_LOG_BYTES = int(os.environ.get('TRAFFIC_LOG_BYTES', 50 * 1024 * 1024))
+TRAFFIC_LOG_BACKUPS = int(os.environ.get('TRAFFIC_LOG_BACKUPS', 5))
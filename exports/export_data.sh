@@ -1,12 +1,12 @@
 #! /bin/bash
 
 # Check for correct number of commandline arguments
-if [ "$#" -ne 2 ]; then
-	echo "\e[1;34mUsage: ./export_data.sh <dbname> <output dir>\e[0m"
+if [ "$#" -lt 2 ]; then
+	echo "\e[1;34mUsage: ./export_data.sh <dbname> <output dir> [--parallel] [--itersize=N]\e[0m"
 	exit;
 fi
 
-python3 migration.py $1
+python3 migrations.py $1 "${@:3}"
 mkdir --parents $2
 mv *.csv $2
 
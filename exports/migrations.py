@@ -1,23 +1,36 @@
 import psycopg2
+import psycopg2.extensions
 import csv
+import multiprocessing
 import sys
+import time
 
 
 # Connect()
-if len(sys.argv) > 1:
-	DB_NAME = sys.argv[1]
+# Usage: migrations.py [<dbname>] [--itersize=<rows fetched per round trip>]
+#                      [--parallel] [--workers=<processes>]
+ARGS = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+OPTIONS = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+if len(ARGS) > 0:
+	DB_NAME = ARGS[0]
 else:
 	DB_NAME = 'lost'
+ITERSIZE = int(OPTIONS.get('itersize') or 5000)
+PARALLEL = 'parallel' in OPTIONS
+WORKERS = int(OPTIONS.get('workers') or 4)
 CONN = psycopg2.connect(dbname=DB_NAME, host='localhost', port=5432)
 CUR = CONN.cursor()
 
 
 def main():
 	# Convert users, facilities, assets, and transfers tables to CSV files
-	export_users()
-	export_facilities()
-	export_assets()
-	export_transfers()
+	if PARALLEL:
+		parallel_export()
+	else:
+		export_users()
+		export_facilities()
+		export_assets()
+		export_transfers()
 
 	# Close Postgres Database
 	CUR.close()
@@ -27,48 +40,63 @@ def main():
 	return
 
 
-def create_csv(csv_filename, header_list, sql_query_string):
+def create_csv(csv_filename, header_list, sql_query_string, conn=None):
 	"""Transfer records from database query to a new .csv file.
 
+    Rows are streamed through a named (server-side) cursor ITERSIZE rows per round
+    trip and written as they arrive, so memory use stays flat however big the table is.
+
     Keyword arguments:
     csv_filename -- String with a '.csv' suffix
     header_list -- List of strings (as CSV header names)
     sql_query_string -- Passed to match header_list format
+    conn -- Connection to export through (defaults to the module connection)
     """
 
+	conn = conn or CONN
+
+	started = time.time()
+	rows = 0
 	with open(csv_filename, 'w', newline='\n') as csvfile:
 		csv_writer = csv.writer(csvfile, quotechar="'", quoting=csv.QUOTE_MINIMAL)
 		csv_writer.writerow(header_list)
 
-		CUR.execute(sql_query_string)
-		records = CUR.fetchall()
-		CONN.commit()
-		for entry in records:
+		export_cur = conn.cursor(name='export_cursor')
+		export_cur.itersize = ITERSIZE
+		export_cur.execute(sql_query_string)
+		for entry in export_cur:
 			csv_writer.writerow(entry)
+			rows += 1
+		export_cur.close()
+		conn.commit()
+
+	elapsed = time.time() - started
+	rate = rows / elapsed if elapsed > 0 else 0
+	print("{}: {} rows in {:.2f}s ({:.0f} rows/s)".format(csv_filename, rows, elapsed, rate))
 
 
-def export_users():
+def export_users(conn=None):
 	fn = 'users.csv'
 	header_names = ['username', 'password', 'role', 'active']
 	query_string = "SELECT u.username, u.password, r.title, TRUE FROM users as u " \
 				   "JOIN roles as r ON u.role_fk = r.role_pk;"
 
-	create_csv(fn, header_names, query_string)
+	create_csv(fn, header_names, query_string, conn)
 	print("\nUsers exported to", fn)
 	return
 
 
-def export_facilities():
+def export_facilities(conn=None):
 	fn = 'facilities.csv'
 	header_names = ['fcode', 'common_name']
 	query_string = "SELECT fcode, common_name FROM facilities;"
 
-	create_csv(fn, header_names, query_string)
+	create_csv(fn, header_names, query_string, conn)
 	print("\nFacilities exported to", fn)
 	return
 
 
-def export_assets():
+def export_assets(conn=None):
 	fn = 'assets.csv'
 	header_names = ['asset_tag', 'description', 'facility', 'acquired', 'disposed']
 	query_string = "SELECT a.asset_tag, a.description, f.fcode, MIN(a_a.arrive_dt)::date, a_a.depart_dt::date " \
@@ -77,12 +105,12 @@ def export_assets():
 				   "JOIN facilities as f ON a_a.facility_fk = f.facility_pk " \
 				   "GROUP BY a.asset_tag, a.description, f.fcode, a_a.depart_dt;"
 
-	create_csv(fn, header_names, query_string)
+	create_csv(fn, header_names, query_string, conn)
 	print("\nAssets exported to", fn)
 	return
 
 
-def export_transfers():
+def export_transfers(conn=None):
 	fn = 'transfers.csv'
 	header_names = ['asset_tag', 'request_by', 'request_dt', 'approve_by', 'approve_dt', 'source', 'destination', 'load_dt', 'unload_dt']
 	query_string = "SELECT a.asset_tag, requester.username, r.request_dt::date, " \
@@ -96,10 +124,60 @@ def export_transfers():
 				   "JOIN facilities as f2 ON r.dest_fk = f2.facility_pk " \
 				   "JOIN in_transit as i_t ON r.request_pk = i_t.request_fk;"
 
-	create_csv(fn, header_names, query_string)
+	create_csv(fn, header_names, query_string, conn)
 	print("\nTransfers exported to", fn)
 	return
 
 
+# Table name -> export function, in the order a serial export runs them
+EXPORTS = {
+	'users': export_users,
+	'facilities': export_facilities,
+	'assets': export_assets,
+	'transfers': export_transfers,
+}
+
+
+def _export_in_snapshot(job):
+	"""Worker process: export one table from inside the coordinator's exported snapshot."""
+	table, snapshot_id = job
+	conn = psycopg2.connect(dbname=DB_NAME, host='localhost', port=5432)
+	conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ,
+					 readonly=True)
+	cur = conn.cursor()
+	cur.execute("SET TRANSACTION SNAPSHOT %s;", [snapshot_id])
+	EXPORTS[table](conn)
+	cur.close()
+	conn.close()
+	return table
+
+
+def parallel_export():
+	"""Export every table concurrently, all from a single point-in-time snapshot.
+
+	The coordinator holds a REPEATABLE READ transaction open and shares its snapshot
+	(pg_export_snapshot) with a pool of worker processes, each of which adopts it with
+	SET TRANSACTION SNAPSHOT before exporting one table on its own connection.
+	"""
+	started = time.time()
+	CONN.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ,
+					 readonly=True)
+	CUR.execute("SELECT pg_export_snapshot();")
+	snapshot_id = CUR.fetchone()[0]
+
+	pool = multiprocessing.Pool(min(WORKERS, len(EXPORTS)))
+	try:
+		for table in pool.imap_unordered(_export_in_snapshot, [(t, snapshot_id) for t in EXPORTS]):
+			print("Finished", table)
+	finally:
+		pool.close()
+		pool.join()
+
+	# Every worker is done with the snapshot, so release it
+	CONN.rollback()
+	print("\nParallel export of", len(EXPORTS), "tables took {:.2f}s".format(time.time() - started))
+	return
+
+
 if __name__ == '__main__':
 	main()
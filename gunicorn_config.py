@@ -0,0 +1,22 @@
+import glob
+import os
+
+from config import METRICS_DIR, THREADS
+
+
+# Passed to gunicorn with --config by the Procfile.
+threads = THREADS
+
+
+def on_starting(server):
+    """Clear Prometheus samples left over from the last run before any worker starts."""
+    if not os.path.isdir(METRICS_DIR):
+        os.makedirs(METRICS_DIR)
+    for sample_file in glob.glob(os.path.join(METRICS_DIR, '*.db')):
+        os.remove(sample_file)
+
+
+def child_exit(server, worker):
+    """Let /metrics drop the live gauges of a worker that has exited."""
+    from app import metrics
+    metrics.mark_worker_dead(worker.pid)
@@ -1,27 +1,46 @@
 import csv
+import io
+import json
+import os
 import sys
+import time
+import bcrypt
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 
 
 # Connect()
-if len(sys.argv) > 2:
-    DB_NAME = sys.argv[1]
-    DIR = sys.argv[2]
+# Usage: import.py [<dbname> <data dir>] [--bulk] [--rounds=<bcrypt cost>] [--batch=<rows>]
+ARGS = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+OPTIONS = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+if len(ARGS) > 1:
+    DB_NAME = ARGS[0]
+    DIR = ARGS[1]
     if DIR != '' and DIR[-1] != '/':
         DIR += '/'
 else:
     DB_NAME = 'lost'
     DIR = 'data/'
+BULK = 'bulk' in OPTIONS
+BCRYPT_ROUNDS = int(OPTIONS.get('rounds') or 12)
+BATCH_SIZE = int(OPTIONS.get('batch') or 1000)
 CONN = psycopg2.connect(dbname=DB_NAME, host='localhost', port=5432)
 CUR = CONN.cursor()
 
 
 def main():
-    # Convert users, facilities, assets, and transfers tables to CSV files
-    import_users()
-    import_facilities()
-    import_assets()
-    import_transfers()
+    # Load users, facilities, assets, and transfers CSV files into their tables
+    if BULK:
+        bulk_import_users()
+        bulk_import_facilities()
+        bulk_import_assets()
+        bulk_import_transfers()
+    else:
+        import_users()
+        import_facilities()
+        import_assets()
+        import_transfers()
 
     # Close Postgres Database
     CUR.close()
@@ -75,6 +94,9 @@ def import_facilities():
                 ]
             )
             CONN.commit()
+    # Tell running app workers to drop their cached facility lists
+    CUR.execute("NOTIFY facilities_changed;")
+    CONN.commit()
     print('Facilities have been imported!')
     return
 
@@ -130,8 +152,47 @@ def import_assets():
     return
 
 
+def _load_lookup(query):
+    """Return a dict mapping the first column of a query to the second, keeping the first seen."""
+    CUR.execute(query)
+    lookup = {}
+    for key, pk in CUR.fetchall():
+        lookup.setdefault(key, pk)
+    return lookup
+
+
+def _read_checkpoint(checkpoint_file, source):
+    """Return how many CSV rows of source a previous, interrupted run already committed."""
+    try:
+        with open(checkpoint_file) as checkpoint_json:
+            checkpoint = json.load(checkpoint_json)
+    except (IOError, ValueError):
+        return 0
+
+    if checkpoint.get('source') != source:
+        print('Ignoring checkpoint for a different file:', checkpoint.get('source'))
+        return 0
+
+    # The run may have died between committing a batch and recording it
+    pending = checkpoint.get('pending')
+    if pending:
+        CUR.execute("SELECT 1 FROM requests WHERE request_pk = %s;", [pending['request_pk']])
+        if CUR.fetchone():
+            return pending['rows_done']
+        CONN.rollback()
+    return checkpoint['rows_done']
+
+
+def _write_checkpoint(checkpoint_file, checkpoint):
+    tmp_file = checkpoint_file + '.tmp'
+    with open(tmp_file, 'w') as checkpoint_json:
+        json.dump(checkpoint, checkpoint_json)
+    os.replace(tmp_file, checkpoint_file)
+
+
 def import_transfers():
     file = DIR + 'transfers.csv'
+    checkpoint_file = file + '.checkpoint'
 
     transfer_reqs_insert = ("INSERT INTO requests ("
                                 "asset_fk, "
@@ -143,25 +204,58 @@ def import_transfers():
                                 "approved, "
                                 "approving_user_fk, "
                                 "completed) "
-                            "VALUES ("
-                                "(SELECT asset_pk FROM assets WHERE asset_tag = %s LIMIT 1), "
-                                "(SELECT user_pk FROM users WHERE username = %s), "
-                                "(SELECT facility_pk FROM facilities WHERE fcode = %s), "
-                                "(SELECT facility_pk FROM facilities WHERE fcode = %s), "
-                                "%s, "
-                                "%s, "
-                                "%s, "
-                                "(SELECT user_pk FROM users WHERE username = %s), "
-                                "%s)")
-
-    in_transit_insert = ("INSERT INTO in_transit (request_fk, load_dt, unload_dt) "
-                         "VALUES (%s, %s, %s);")
-
+                            "VALUES %s "
+                            "RETURNING request_pk;")
+
+    in_transit_insert = "INSERT INTO in_transit (request_fk, load_dt, unload_dt) VALUES %s;"
+
+    # Natural key -> primary key caches, loaded once for the whole run
+    assets = _load_lookup("SELECT asset_tag, asset_pk FROM assets ORDER BY asset_pk;")
+    users = _load_lookup("SELECT username, user_pk FROM users ORDER BY user_pk;")
+    facilities = _load_lookup("SELECT fcode, facility_pk FROM facilities ORDER BY facility_pk;")
+    CONN.commit()
+
+    rows_done = _read_checkpoint(checkpoint_file, file)
+    if rows_done:
+        print('Resuming transfers import after row', rows_done)
+
+    def flush(batch, rows_read):
+        """Insert one batch of requests and their in_transit rows in a single transaction."""
+        checkpoint = {'source': file, 'rows_done': rows_done}
+        if batch:
+            # page_size covers the whole batch so RETURNING yields one key per VALUES row, in order
+            execute_values(CUR, transfer_reqs_insert, [request for request, transit in batch],
+                           page_size=len(batch))
+            request_pks = [row[0] for row in CUR.fetchall()]
+            # Only approved requests are in transit; approving one later adds its row
+            transits = [(request_pk,) + transit for request_pk, (request, transit)
+                        in zip(request_pks, batch) if request[6] == 'TRUE']
+            if transits:
+                execute_values(CUR, in_transit_insert, transits, page_size=len(transits))
+            checkpoint['pending'] = {'rows_done': rows_done + rows_read, 'request_pk': request_pks[0]}
+            _write_checkpoint(checkpoint_file, checkpoint)
+
+        CONN.commit()
+        _write_checkpoint(checkpoint_file, {'source': file, 'rows_done': rows_done + rows_read})
+        return rows_done + rows_read
+
+    skipped = 0
     with open(file) as csvfile:
         rows = csv.DictReader(csvfile, delimiter=",", quotechar="'")
-        if __name__ == '__main__':
-            for record in rows:
-                print('\nCURRENT RECORD:', record)
+        batch = []
+        rows_read = 0
+        for row_number, record in enumerate(rows):
+            if row_number < rows_done:
+                continue
+            rows_read += 1
+
+            asset_fk = assets.get(record['asset_tag'])
+            user_fk = users.get(record['request_by'])
+            src_fk = facilities.get(record['source'])
+            dest_fk = facilities.get(record['destination'])
+            if asset_fk is None or user_fk is None or src_fk is None or dest_fk is None:
+                skipped += 1
+            else:
                 # Insert into requests table...
                 if record['approve_dt'] == '':
                     approved = 'FALSE'
@@ -171,47 +265,224 @@ def import_transfers():
                 unload_dt = record['unload_dt']
                 if unload_dt == '' or unload_dt == 'NULL' or unload_dt is None:
                     completed = 'FALSE'
+                    unload_dt = None
                 else:
                     completed = 'TRUE'
 
-                CUR.execute(
-                    transfer_reqs_insert, (
-                        record['asset_tag'],
-                        record['request_by'],
-                        record['source'],
-                        record['destination'],
-                        record['request_dt'],
-                        record['approve_dt'],
-                        approved,
-                        record['approve_by'],
-                        completed
-                    )
-                )
-                CONN.commit()
-
                 # Insert into in_transit table...
-                CUR.execute("SELECT request_pk FROM requests;")
-                request_fk = CUR.fetchall()[-1][0]
-                CONN.commit()
-
                 load_dt = record['load_dt']
                 if load_dt == '':
                     load_dt = None
                     unload_dt = None  # LOGIC: If no load time, then no unload time!
-                else:
-                    if unload_dt == '':
-                        unload_dt = None
-
-                print('\nHere\'s the in_transit entry:', request_fk, load_dt, unload_dt, '\n')
-
-                CUR.execute(
-                    in_transit_insert, [
-                        request_fk,
-                        load_dt,
-                        unload_dt
-                    ]
-                )
-                CONN.commit()
+
+                batch.append((
+                    (
+                        asset_fk,
+                        user_fk,
+                        src_fk,
+                        dest_fk,
+                        record['request_dt'] or None,
+                        record['approve_dt'] or None,
+                        approved,
+                        users.get(record['approve_by']),
+                        completed
+                    ),
+                    (load_dt, unload_dt)
+                ))
+
+            if rows_read == BATCH_SIZE:
+                rows_done = flush(batch, rows_read)
+                print('    committed', rows_done, 'transfers')
+                batch = []
+                rows_read = 0
+
+        if rows_read:
+            rows_done = flush(batch, rows_read)
+
+    # A file with no data rows never wrote a checkpoint
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    if skipped:
+        print('Skipped', skipped, 'transfers with an unknown asset, user or facility')
+    print('Requests and in_transit tables have been populated!')
+    return
+
+
+# BULK MODE
+# Each CSV is streamed into a TEMP staging table with COPY, foreign keys are resolved
+# with set-based joins, and every table is committed exactly once.
+def _report(phase, rows, started):
+    """Print the row count, duration and throughput of one import phase."""
+    elapsed = time.time() - started
+    rate = rows / elapsed if elapsed > 0 else 0
+    print('    {:<28}{:>10} rows {:>9.2f}s {:>12.0f} rows/s'.format(phase, rows, elapsed, rate))
+
+
+def _stage_csv(filename, stage_table):
+    """COPY a CSV file into a TEMP table of TEXT columns named after the CSV header.
+
+    The staging table also gets a stage_id column numbering rows in file order, and
+    is dropped when the current transaction commits. Returns the header columns.
+    """
+    started = time.time()
+    with open(filename) as csvfile:
+        header = next(csv.reader([csvfile.readline()], delimiter=",", quotechar="'"))
+        columns = [name.strip() for name in header]
+
+        CUR.execute(sql.SQL("CREATE TEMP TABLE {} (stage_id SERIAL, {}) ON COMMIT DROP;").format(
+            sql.Identifier(stage_table),
+            sql.SQL(', ').join(sql.SQL("{} TEXT").format(sql.Identifier(c)) for c in columns)
+        ))
+        copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, QUOTE '''');").format(
+            sql.Identifier(stage_table),
+            sql.SQL(', ').join(sql.Identifier(c) for c in columns)
+        )
+        CUR.copy_expert(copy_sql.as_string(CONN), csvfile)
+
+    _report('COPY ' + filename.split('/')[-1], CUR.rowcount, started)
+    return columns
+
+
+def bulk_import_users():
+    print('Importing users...')
+    _stage_csv(DIR + 'users.csv', 'stage_users')
+
+    # bcrypt hashes cannot be computed in SQL, so they are streamed back in with a second COPY
+    started = time.time()
+    CUR.execute("SELECT stage_id, password FROM stage_users;")
+    hashes = io.StringIO()
+    hash_writer = csv.writer(hashes)
+    hashed = 0
+    for stage_id, password in CUR.fetchall():
+        salt = bcrypt.gensalt(BCRYPT_ROUNDS)
+        hashed_pass = bcrypt.hashpw((password or '').encode('utf-8'), salt)
+        hash_writer.writerow([stage_id, '\\x' + hashed_pass.hex(), '\\x' + salt.hex()])
+        hashed += 1
+    hashes.seek(0)
+    CUR.execute("CREATE TEMP TABLE stage_user_hashes "
+                "(stage_id INTEGER, password BYTEA, salt BYTEA) ON COMMIT DROP;")
+    CUR.copy_expert("COPY stage_user_hashes FROM STDIN WITH (FORMAT csv);", hashes)
+    _report('hash passwords', hashed, started)
+
+    started = time.time()
+    CUR.execute("INSERT INTO users (role_fk, username, password, salt, active) "
+                "SELECT CASE s.role "
+                "WHEN 'Logistics Officer' THEN 2 WHEN 'Facilities Officer' THEN 3 ELSE 1 END, "
+                "s.username, h.password, h.salt, COALESCE(s.active::boolean, TRUE) "
+                "FROM stage_users as s JOIN stage_user_hashes as h ON h.stage_id = s.stage_id "
+                "ORDER BY s.stage_id;")
+    _report('INSERT users', CUR.rowcount, started)
+    CONN.commit()
+    print('Users have been imported!')
+    return
+
+
+def bulk_import_facilities():
+    print('Importing facilities...')
+    columns = _stage_csv(DIR + 'facilities.csv', 'stage_facilities')
+    location = 'location' if 'location' in columns else 'NULL'
+
+    started = time.time()
+    CUR.execute("INSERT INTO facilities (fcode, common_name, location) "
+                "SELECT fcode, common_name, " + location + " FROM stage_facilities "
+                "ORDER BY stage_id;")
+    _report('INSERT facilities', CUR.rowcount, started)
+    # Tell running app workers to drop their cached facility lists
+    CUR.execute("NOTIFY facilities_changed;")
+    CONN.commit()
+    print('Facilities have been imported!')
+    return
+
+
+def bulk_import_assets():
+    print('Importing assets...')
+    _stage_csv(DIR + 'assets.csv', 'stage_assets')
+
+    # Reserve an asset_pk per staged row so assets and asset_at rows pair up without lookups
+    started = time.time()
+    CUR.execute("CREATE TEMP TABLE stage_asset_keys ON COMMIT DROP AS "
+                "SELECT s.stage_id, f.facility_pk, "
+                "nextval(pg_get_serial_sequence('assets', 'asset_pk')) AS asset_pk "
+                "FROM stage_assets as s "
+                "JOIN (SELECT fcode, MIN(facility_pk) AS facility_pk FROM facilities GROUP BY fcode) "
+                "as f ON f.fcode = s.facility;")
+    keyed = CUR.rowcount
+    _report('resolve facilities', keyed, started)
+
+    started = time.time()
+    CUR.execute("INSERT INTO assets (asset_pk, asset_tag, description, disposed) "
+                "SELECT k.asset_pk, s.asset_tag, s.description, "
+                "COALESCE(s.disposed, '') NOT IN ('', 'NULL') "
+                "FROM stage_assets as s JOIN stage_asset_keys as k ON k.stage_id = s.stage_id "
+                "ORDER BY s.stage_id;")
+    _report('INSERT assets', CUR.rowcount, started)
+
+    started = time.time()
+    CUR.execute("INSERT INTO asset_at (asset_fk, facility_fk, arrive_dt, depart_dt) "
+                "SELECT k.asset_pk, k.facility_pk, s.acquired::timestamp, "
+                "NULLIF(NULLIF(s.disposed, 'NULL'), '')::timestamp "
+                "FROM stage_assets as s JOIN stage_asset_keys as k ON k.stage_id = s.stage_id "
+                "ORDER BY s.stage_id;")
+    _report('INSERT asset_at', CUR.rowcount, started)
+
+    CUR.execute("SELECT COUNT(*) FROM stage_assets;")
+    skipped = CUR.fetchone()[0] - keyed
+    if skipped:
+        print('    Skipped', skipped, 'assets with an unknown facility fcode')
+    CONN.commit()
+    print('Assets and asset_at tables have been populated!')
+    return
+
+
+def bulk_import_transfers():
+    print('Importing transfers...')
+    _stage_csv(DIR + 'transfers.csv', 'stage_transfers')
+
+    # Resolve every foreign key in one pass and reserve a request_pk per transfer
+    started = time.time()
+    CUR.execute("CREATE TEMP TABLE stage_transfer_keys ON COMMIT DROP AS "
+                "SELECT s.stage_id, a.asset_pk, requester.user_pk, approver.user_pk AS approver_pk, "
+                "src.facility_pk AS src_pk, dest.facility_pk AS dest_pk, "
+                "nextval(pg_get_serial_sequence('requests', 'request_pk')) AS request_pk "
+                "FROM stage_transfers as s "
+                "JOIN (SELECT asset_tag, MIN(asset_pk) AS asset_pk FROM assets GROUP BY asset_tag) "
+                "as a ON a.asset_tag = s.asset_tag "
+                "JOIN users as requester ON requester.username = s.request_by "
+                "LEFT JOIN users as approver ON approver.username = s.approve_by "
+                "JOIN (SELECT fcode, MIN(facility_pk) AS facility_pk FROM facilities GROUP BY fcode) "
+                "as src ON src.fcode = s.source "
+                "JOIN (SELECT fcode, MIN(facility_pk) AS facility_pk FROM facilities GROUP BY fcode) "
+                "as dest ON dest.fcode = s.destination;")
+    keyed = CUR.rowcount
+    _report('resolve keys', keyed, started)
+
+    started = time.time()
+    CUR.execute("INSERT INTO requests (request_pk, asset_fk, user_fk, src_fk, dest_fk, "
+                "request_dt, approve_dt, approved, approving_user_fk, completed) "
+                "SELECT k.request_pk, k.asset_pk, k.user_pk, k.src_pk, k.dest_pk, "
+                "NULLIF(s.request_dt, '')::timestamp, NULLIF(s.approve_dt, '')::timestamp, "
+                "COALESCE(s.approve_dt, '') <> '', k.approver_pk, "
+                "COALESCE(s.unload_dt, '') NOT IN ('', 'NULL') "
+                "FROM stage_transfers as s JOIN stage_transfer_keys as k ON k.stage_id = s.stage_id "
+                "ORDER BY s.stage_id;")
+    _report('INSERT requests', CUR.rowcount, started)
+
+    # LOGIC: If no load time, then no unload time! Only approved requests are in transit.
+    started = time.time()
+    CUR.execute("INSERT INTO in_transit (request_fk, load_dt, unload_dt) "
+                "SELECT k.request_pk, NULLIF(s.load_dt, '')::timestamp, "
+                "CASE WHEN COALESCE(s.load_dt, '') = '' THEN NULL "
+                "ELSE NULLIF(NULLIF(s.unload_dt, ''), 'NULL')::timestamp END "
+                "FROM stage_transfers as s JOIN stage_transfer_keys as k ON k.stage_id = s.stage_id "
+                "WHERE COALESCE(s.approve_dt, '') <> '' "
+                "ORDER BY s.stage_id;")
+    _report('INSERT in_transit', CUR.rowcount, started)
+
+    CUR.execute("SELECT COUNT(*) FROM stage_transfers;")
+    skipped = CUR.fetchone()[0] - keyed
+    if skipped:
+        print('    Skipped', skipped, 'transfers with an unknown asset, user or facility')
+    CONN.commit()
     print('Requests and in_transit tables have been populated!')
     return
 
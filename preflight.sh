@@ -12,4 +12,7 @@ fi
 printf '\e[1;34m\n~~~CREATING USERS TABLE~~~\n\e[0m'
 cd sql
 psql $1 -f create_tables.sql
+
+printf '\e[1;34m\n~~~APPLYING MIGRATIONS~~~\n\e[0m'
+python3 migrate.py $1
 cd ..
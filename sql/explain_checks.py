@@ -0,0 +1,220 @@
+import sys
+import psycopg2
+
+
+# Usage: explain_checks.py <dbname> [--assets=<synthetic assets>] [--depth=<stays per asset>]
+# Loads a large synthetic dataset inside a transaction, EXPLAINs every hot dashboard and
+# report query against it, checks that each one is served by its index, then rolls back.
+ARGS = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+OPTIONS = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+if len(ARGS) > 0:
+    DB_NAME = ARGS[0]
+else:
+    DB_NAME = 'lost'
+ASSETS = int(OPTIONS.get('assets') or 100000)
+DEPTH = int(OPTIONS.get('depth') or 20)
+FACILITIES = 40
+USERS = 20
+REPORT_DATE = '2000-06-01'
+
+INDEX_NODES = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+# (name, query, acceptable indexes) - queries mirror the ones issued by app/views
+CHECKS = [
+    ('facility officer dashboard',
+     "SELECT r.request_pk, a.asset_tag, r.user_fk, "
+     "f1.common_name, f2.common_name FROM requests as r "
+     "JOIN assets as a ON r.asset_fk = a.asset_pk "
+     "JOIN facilities as f1 ON r.src_fk = f1.facility_pk "
+     "JOIN facilities as f2 ON r.dest_fk = f2.facility_pk "
+     "WHERE r.approved = FALSE AND r.completed = FALSE;",
+     ('requests_pending_idx',)),
+    ('logistics officer dashboard',
+     "SELECT r.request_pk, a.asset_tag, r.user_fk, "
+     "f1.common_name, f2.common_name, t.load_dt, t.unload_dt "
+     "FROM requests as r JOIN assets as a ON r.asset_fk = a.asset_pk "
+     "JOIN facilities as f1 on r.src_fk = f1.facility_pk "
+     "JOIN facilities as f2 on r.dest_fk = f2.facility_pk "
+     "JOIN in_transit as t ON r.request_pk = t.request_fk "
+     "WHERE r.approved = TRUE AND r.completed = FALSE;",
+     ('requests_in_progress_idx',)),
+    ('logistics officer load date lookup',
+     "SELECT r.request_pk, t.load_dt FROM requests as r "
+     "JOIN in_transit as t ON r.request_pk = t.request_fk "
+     "WHERE r.approved = TRUE AND r.request_pk = {request_pk};",
+     ('in_transit_request_fk_idx',)),
+    ('asset report (all facilities)',
+     "SELECT a.asset_tag, a.description, f.location, "
+     "a_a.arrive_dt, a_a.depart_dt FROM assets as a "
+     "JOIN asset_at as a_a ON a.asset_pk = a_a.asset_fk "
+     "JOIN facilities as f ON a_a.facility_fk = f.facility_pk "
+     "WHERE a_a.valid_during @> '{date}'::timestamp;",
+     ('asset_at_valid_during_idx',)),
+    ('asset report (one facility)',
+     "SELECT a.asset_tag, a.description, "
+     "f.location, a_a.arrive_dt, a_a.depart_dt "
+     "FROM assets as a "
+     "JOIN asset_at as a_a ON a.asset_pk = a_a.asset_fk "
+     "JOIN ("
+     "SELECT facility_pk, location FROM facilities "
+     "WHERE facility_pk = {facility_pk}"
+     ") as f ON f.facility_pk = a_a.facility_fk "
+     "WHERE a_a.valid_during @> '{date}'::timestamp;",
+     ('asset_at_facility_valid_during_idx', 'asset_at_valid_during_idx')),
+    ('asset tag lookup',
+     "SELECT asset_pk FROM assets WHERE asset_tag = '{asset_tag}';",
+     ('assets_tag_pk_idx',)),
+    ('add asset table page',
+     "SELECT assets.asset_tag, assets.description, facilities.location, "
+     "assets.asset_tag, assets.asset_pk "
+     "FROM assets "
+     "JOIN asset_current ON assets.asset_pk = asset_current.asset_fk "
+     "JOIN facilities ON asset_current.facility_fk = facilities.facility_pk "
+     "WHERE assets.asset_tag >= '{asset_tag}' AND "
+     "(assets.asset_tag, assets.asset_pk) > ('{asset_tag}', 0) "
+     "ORDER BY assets.asset_tag, assets.asset_pk LIMIT 51;",
+     ('assets_tag_pk_idx',)),
+    ('transfer request eligible assets',
+     "SELECT a.asset_pk, a.asset_tag, c.facility_fk "
+     "FROM assets as a "
+     "JOIN asset_current as c ON a.asset_pk = c.asset_fk "
+     "JOIN facilities as f ON c.facility_fk = f.facility_pk "
+     "WHERE NOT c.in_transit AND a.disposed IS NOT TRUE "
+     "AND NOT EXISTS (SELECT 1 FROM requests as r "
+     "WHERE r.asset_fk = a.asset_pk AND r.completed = FALSE) "
+     "AND c.facility_fk = {facility_pk} ORDER BY a.asset_tag, a.asset_pk;",
+     ('requests_open_asset_fk_idx',)),
+    ('transfer request eligible tags',
+     "SELECT a.asset_pk, a.asset_tag, c.facility_fk "
+     "FROM assets as a "
+     "JOIN asset_current as c ON a.asset_pk = c.asset_fk "
+     "JOIN facilities as f ON c.facility_fk = f.facility_pk "
+     "WHERE NOT c.in_transit AND a.disposed IS NOT TRUE "
+     "AND NOT EXISTS (SELECT 1 FROM requests as r "
+     "WHERE r.asset_fk = a.asset_pk AND r.completed = FALSE) "
+     "AND a.asset_tag = ANY(ARRAY['{asset_tag}']) ORDER BY a.asset_tag, a.asset_pk;",
+     ('assets_tag_pk_idx',)),
+    ('transfer request asset page',
+     "SELECT a.asset_pk, a.asset_tag, f.common_name, a.asset_tag, a.asset_pk "
+     "FROM assets as a "
+     "JOIN asset_current as c ON a.asset_pk = c.asset_fk "
+     "JOIN facilities as f ON c.facility_fk = f.facility_pk "
+     "WHERE NOT c.in_transit AND a.disposed IS NOT TRUE "
+     "AND NOT EXISTS (SELECT 1 FROM requests as r "
+     "WHERE r.asset_fk = a.asset_pk AND r.completed = FALSE) "
+     "AND a.asset_tag >= '{asset_tag}' AND "
+     "(a.asset_tag, a.asset_pk) > ('{asset_tag}', 0) "
+     "ORDER BY a.asset_tag, a.asset_pk LIMIT 51;",
+     ('assets_tag_pk_idx',)),
+    ('transfer request asset location',
+     "SELECT facility_fk, in_transit FROM asset_current "
+     "WHERE asset_fk = {asset_pk};",
+     ('asset_current_pkey',)),
+]
+
+
+def load_synthetic_data(cur):
+    """Insert ASSETS assets with DEPTH stays each plus a request per asset; returns sample keys."""
+    cur.execute("WITH f AS ("
+                "INSERT INTO facilities (fcode, common_name, location) "
+                "SELECT 'X' || g, 'Synthetic ' || g, 'Nowhere ' || g "
+                "FROM generate_series(1, %s) as g RETURNING facility_pk"
+                ") SELECT array_agg(facility_pk) FROM f;", [FACILITIES])
+    facility_pks = cur.fetchone()[0]
+
+    cur.execute("WITH u AS ("
+                "INSERT INTO users (role_fk, username, salt, password) "
+                "SELECT 2, 'synthetic' || g, '\\x00', '\\x00' "
+                "FROM generate_series(1, %s) as g RETURNING user_pk"
+                ") SELECT array_agg(user_pk) FROM u;", [USERS])
+    user_pks = cur.fetchone()[0]
+
+    cur.execute("WITH a AS ("
+                "INSERT INTO assets (asset_tag, description, disposed) "
+                "SELECT 'SYN' || g, 'Synthetic asset ' || g, FALSE "
+                "FROM generate_series(1, %s) as g RETURNING asset_pk"
+                ") SELECT min(asset_pk), max(asset_pk) FROM a;", [ASSETS])
+    first_asset, last_asset = cur.fetchone()
+
+    # DEPTH consecutive stays per asset, ~100 days each, the last one still open
+    cur.execute("INSERT INTO asset_at (asset_fk, facility_fk, arrive_dt, depart_dt) "
+                "SELECT a, (%(facilities)s)[1 + (a + k) %% %(n)s], "
+                "DATE '2000-01-01' + (k * 100 + a %% 50), "
+                "CASE WHEN k < %(depth)s THEN DATE '2000-01-01' + ((k + 1) * 100 + a %% 50) END "
+                "FROM generate_series(%(first)s, %(last)s) as a, "
+                "generate_series(1, %(depth)s) as k;",
+                {'facilities': facility_pks, 'n': len(facility_pks), 'depth': DEPTH,
+                 'first': first_asset, 'last': last_asset})
+
+    # One request per asset: 1% pending approval, 1% in transit, the rest completed
+    cur.execute("WITH r AS ("
+                "INSERT INTO requests (asset_fk, user_fk, src_fk, dest_fk, request_dt, "
+                "approve_dt, approved, approving_user_fk, completed) "
+                "SELECT a, (%(users)s)[1 + a %% %(nu)s], "
+                "(%(facilities)s)[1 + a %% %(nf)s], (%(facilities)s)[1 + (a + 1) %% %(nf)s], "
+                "now(), now(), a %% 100 <> 0, (%(users)s)[1 + (a + 1) %% %(nu)s], a %% 100 > 1 "
+                "FROM generate_series(%(first)s, %(last)s) as a RETURNING request_pk, approved"
+                "), t AS ("
+                "INSERT INTO in_transit (request_fk, load_dt, unload_dt) "
+                "SELECT request_pk, now(), now() FROM r WHERE approved RETURNING request_fk"
+                ") SELECT min(request_fk) FROM t;",
+                {'users': user_pks, 'nu': len(user_pks), 'facilities': facility_pks,
+                 'nf': len(facility_pks), 'first': first_asset, 'last': last_asset})
+    request_pk = cur.fetchone()[0]
+
+    for table in ('facilities', 'users', 'assets', 'asset_at', 'asset_current', 'requests',
+                  'in_transit'):
+        cur.execute("ANALYZE " + table + ";")
+
+    return {
+        'facility_pk': facility_pks[0],
+        'asset_pk': last_asset,
+        'asset_tag': 'SYN%d' % (ASSETS // 2),
+        'request_pk': request_pk,
+        'date': REPORT_DATE,
+    }
+
+
+def indexes_used(plan):
+    """Return the names of every index scanned anywhere in an EXPLAIN (FORMAT JSON) plan."""
+    found = set()
+    if plan.get('Node Type') in INDEX_NODES:
+        found.add(plan.get('Index Name'))
+    for child in plan.get('Plans', []):
+        found |= indexes_used(child)
+    return found
+
+
+def main():
+    conn = psycopg2.connect(dbname=DB_NAME, host='localhost', port=5432)
+    cur = conn.cursor()
+    failures = 0
+    try:
+        print('Loading', ASSETS, 'synthetic assets with', DEPTH, 'stays each...')
+        sample = load_synthetic_data(cur)
+
+        for name, query, expected_indexes in CHECKS:
+            cur.execute("EXPLAIN (FORMAT JSON) " + query.format(**sample))
+            plan = cur.fetchone()[0][0]['Plan']
+            used = indexes_used(plan)
+            matched = [index for index in expected_indexes if index in used]
+            if matched:
+                print('PASS', name, '->', matched[0])
+            else:
+                failures += 1
+                print('FAIL', name, '-> expected one of', list(expected_indexes),
+                      'but plan used', sorted(used) or 'no index')
+    finally:
+        # The synthetic data is never committed
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+    if failures:
+        sys.exit(1)
+    print('\nEvery hot query is served by an index.')
+    return
+
+
+if __name__ == '__main__':
+    main()
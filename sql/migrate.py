@@ -0,0 +1,47 @@
+import os
+import sys
+import psycopg2
+
+
+# Usage: migrate.py <dbname>
+# Applies every sql/migrations/*.sql file not yet recorded in schema_migrations, in
+# filename order, each inside its own transaction.
+if len(sys.argv) > 1:
+    DB_NAME = sys.argv[1]
+else:
+    DB_NAME = 'lost'
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def main():
+    conn = psycopg2.connect(dbname=DB_NAME, host='localhost', port=5432)
+    cur = conn.cursor()
+
+    cur.execute("CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version VARCHAR(128) PRIMARY KEY, "
+                "applied_at TIMESTAMP DEFAULT now());")
+    conn.commit()
+
+    cur.execute("SELECT version FROM schema_migrations;")
+    applied = set(row[0] for row in cur.fetchall())
+
+    pending = sorted(fn for fn in os.listdir(MIGRATIONS_DIR) if fn.endswith('.sql'))
+    for filename in pending:
+        version = filename[:-len('.sql')]
+        if version in applied:
+            continue
+
+        print('Applying migration', version)
+        with open(os.path.join(MIGRATIONS_DIR, filename)) as migration:
+            cur.execute(migration.read())
+        cur.execute("INSERT INTO schema_migrations (version) VALUES (%s);", [version])
+        conn.commit()
+
+    cur.close()
+    conn.close()
+    print('Database schema is up to date.')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+-- Secondary indexes for the columns the views filter and join on.
+-- Applied by migrate.py; explain_checks.py verifies the planner actually uses them.
+
+-- Asset history lookups (transfer_req, dashboard, dispose_asset)
+CREATE INDEX asset_at_asset_fk_idx ON asset_at (asset_fk);
+
+-- Per-facility inventory on a date (asset_report)
+CREATE INDEX asset_at_facility_dates_idx ON asset_at (facility_fk, arrive_dt, depart_dt);
+
+-- Natural key lookups (add_asset, dispose_asset, imports). The paginated asset tables
+-- (add_asset, dispose_asset, asset_report) seek on (asset_tag, asset_pk), so each page is
+-- an index range scan from the cursor onwards instead of a sort of the whole inventory.
+-- Tags are not unique (re-used tags exist in the legacy data), hence asset_pk as the
+-- tie-breaker; the same index serves the plain tag lookups.
+CREATE INDEX assets_tag_pk_idx ON assets (asset_tag, asset_pk);
+CREATE INDEX facilities_fcode_idx ON facilities (fcode);
+
+-- Assets with open requests (transfer_req)
+CREATE INDEX requests_asset_fk_idx ON requests (asset_fk);
+
+-- Open request states: only a thin slice of requests is ever pending or in transit
+CREATE INDEX requests_pending_idx ON requests (request_pk)
+    WHERE approved = FALSE AND completed = FALSE; -- Facility officer dashboard
+CREATE INDEX requests_in_progress_idx ON requests (request_pk)
+    WHERE approved = TRUE AND completed = FALSE; -- Logistics officer dashboard
+
+-- An approved request has exactly one in_transit record. Older imports gave every
+-- request one up front and approving it added another, so first drop the records of
+-- requests that are not approved and keep the one furthest along (unloaded, then loaded,
+-- then the newest) for each of the rest.
+DELETE FROM in_transit as t
+USING requests as r
+WHERE r.request_pk = t.request_fk AND r.approved = FALSE;
+DELETE FROM in_transit
+WHERE in_transit_pk IN (
+    SELECT in_transit_pk FROM (
+        SELECT in_transit_pk, row_number() OVER (
+            PARTITION BY request_fk
+            ORDER BY unload_dt IS NULL, load_dt IS NULL, in_transit_pk DESC
+        ) as keep_rank
+        FROM in_transit
+    ) as ranked
+    WHERE keep_rank > 1
+);
+CREATE UNIQUE INDEX in_transit_request_fk_idx ON in_transit (request_fk);
@@ -0,0 +1,22 @@
+-- The period each asset_at row covers, so "what was where on a date" is a single range
+-- containment test instead of an OR that no B-tree can serve. Both ends are inclusive to
+-- match the report's "arrived on or before, departed on or after" rule; an open stay is
+-- unbounded above, and a row without an arrival or that departs before it arrives covers
+-- nothing. Generated columns need PostgreSQL 12 or later.
+ALTER TABLE asset_at ADD COLUMN valid_during TSRANGE GENERATED ALWAYS AS (
+    CASE WHEN arrive_dt IS NULL OR depart_dt < arrive_dt THEN 'empty'::tsrange
+         ELSE tsrange(arrive_dt, depart_dt, '[]') END
+) STORED;
+
+-- Inventory across all facilities on a date (asset_report "All")
+CREATE INDEX asset_at_valid_during_idx ON asset_at USING gist (valid_during);
+
+-- Inventory at one facility on a date needs btree_gist to put facility_fk in the same
+-- GiST index. Without it the planner combines the two indexes above instead.
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+    CREATE INDEX asset_at_facility_valid_during_idx ON asset_at USING gist (facility_fk, valid_during);
+EXCEPTION WHEN feature_not_supported OR undefined_file OR insufficient_privilege THEN
+    RAISE NOTICE 'btree_gist is unavailable, skipping asset_at_facility_valid_during_idx';
+END $$;
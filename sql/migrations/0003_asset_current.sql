@@ -0,0 +1,79 @@
+-- Where every asset is now, one row per asset, so the views stop deriving it from the
+-- whole asset_at history. The current stay is the one that arrived last (an open stay
+-- wins a tie). in_transit means that stay has ended but the asset was not disposed, i.e.
+-- it has been loaded and not yet unloaded anywhere.
+CREATE TABLE asset_current (
+    asset_fk        INTEGER PRIMARY KEY REFERENCES assets(asset_pk) ON DELETE CASCADE,
+    facility_fk     INTEGER REFERENCES facilities(facility_pk) NOT NULL,
+    arrive_dt       TIMESTAMP, -- UTC, arrival of the current stay
+    in_transit      BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+-- Recomputes asset_current for the given assets from their asset_at rows. Each asset is
+-- one asset_at_asset_fk_idx lookup, so a change costs the same however big the table is.
+CREATE FUNCTION refresh_asset_current(changed INTEGER[]) RETURNS void AS $$
+    INSERT INTO asset_current (asset_fk, facility_fk, arrive_dt, in_transit)
+    SELECT c.asset_fk, s.facility_fk, s.arrive_dt,
+           s.depart_dt IS NOT NULL AND NOT COALESCE(a.disposed, FALSE)
+    FROM unnest(changed) as c(asset_fk)
+    JOIN assets as a ON a.asset_pk = c.asset_fk
+    CROSS JOIN LATERAL (
+        SELECT facility_fk, arrive_dt, depart_dt FROM asset_at
+        WHERE asset_fk = c.asset_fk
+        ORDER BY arrive_dt DESC NULLS LAST, depart_dt DESC NULLS FIRST
+        LIMIT 1
+    ) as s
+    ON CONFLICT (asset_fk) DO UPDATE SET
+        facility_fk = EXCLUDED.facility_fk,
+        arrive_dt = EXCLUDED.arrive_dt,
+        in_transit = EXCLUDED.in_transit;
+
+    DELETE FROM asset_current as c
+    WHERE c.asset_fk = ANY(changed)
+      AND NOT EXISTS (SELECT 1 FROM asset_at WHERE asset_fk = c.asset_fk);
+$$ LANGUAGE sql;
+
+-- Statement-level triggers with transition tables, so a bulk import refreshes each asset
+-- once per statement rather than once per row
+CREATE FUNCTION asset_at_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_asset_current(ARRAY(SELECT DISTINCT asset_fk FROM new_stays));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM refresh_asset_current(ARRAY(
+            SELECT asset_fk FROM new_stays UNION SELECT asset_fk FROM old_stays
+        ));
+    ELSE
+        PERFORM refresh_asset_current(ARRAY(SELECT DISTINCT asset_fk FROM old_stays));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER asset_at_inserted AFTER INSERT ON asset_at
+    REFERENCING NEW TABLE AS new_stays
+    FOR EACH STATEMENT EXECUTE PROCEDURE asset_at_changed();
+CREATE TRIGGER asset_at_updated AFTER UPDATE ON asset_at
+    REFERENCING OLD TABLE AS old_stays NEW TABLE AS new_stays
+    FOR EACH STATEMENT EXECUTE PROCEDURE asset_at_changed();
+CREATE TRIGGER asset_at_deleted AFTER DELETE ON asset_at
+    REFERENCING OLD TABLE AS old_stays
+    FOR EACH STATEMENT EXECUTE PROCEDURE asset_at_changed();
+
+-- Disposing of an asset clears its in_transit flag
+CREATE FUNCTION assets_disposed_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_asset_current(ARRAY(
+        SELECT n.asset_pk FROM new_assets as n JOIN old_assets as o ON o.asset_pk = n.asset_pk
+        WHERE n.disposed IS DISTINCT FROM o.disposed
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER assets_disposed_updated AFTER UPDATE ON assets
+    REFERENCING OLD TABLE AS old_assets NEW TABLE AS new_assets
+    FOR EACH STATEMENT EXECUTE PROCEDURE assets_disposed_changed();
+
+-- Existing assets
+SELECT refresh_asset_current(ARRAY(SELECT asset_pk FROM assets));
@@ -0,0 +1,4 @@
+-- Assets with an open request, whether awaiting approval or in transit, cannot be
+-- requested again. transfer_req lists the others with a NOT EXISTS anti-join against
+-- this index, which only holds the thin slice of requests that are not completed.
+CREATE INDEX requests_open_asset_fk_idx ON requests (asset_fk) WHERE completed = FALSE;